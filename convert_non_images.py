@@ -1,10 +1,14 @@
 import argparse
+import contextlib
+import io
 import os
-import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 from utils import ensure_ext, DEF_EXT
+from video_to_frames import extract_frames
 
 # Common video file extensions
 VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm'}
@@ -34,22 +38,19 @@ def process_file(file_path, base_frames_dir, upscale=False):
     print(f"Output directory: {output_dir}")
     
     try:
-        # Call video_to_frames.py
-        cmd = [
-            sys.executable,
-            'video_to_frames.py',
-            file_path,
-            '-o', output_dir
-        ]
-        
-        # Add upscale flag if enabled
-        if upscale:
-            cmd.append('--upscale')
-        
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
+        # Extract frames in-process instead of spawning a new interpreter per video
+        extract_frames(file_path, output_dir=output_dir, upscale=upscale)
+    except Exception as e:
         print(f"Error processing video {file_path}: {e}", file=sys.stderr)
 
+def process_file_captured(file_path, base_frames_dir, upscale=False):
+    """Process a single file in a worker process and return its console output."""
+    # Collect output so that logs of parallel conversions don't interleave
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        process_file(file_path, base_frames_dir, upscale)
+    return output.getvalue()
+
 def main():
     parser = argparse.ArgumentParser(description='Convert non-image files (videos) to frames')
     parser.add_argument('input_file', nargs='?', default=f'non_photos.{DEF_EXT}',
@@ -58,21 +59,32 @@ def main():
                        help='Base directory for output frames')
     parser.add_argument('-u', '--upscale', action='store_true',
                        help='Upscale frames that are below FullHD (1920x1080) resolution')
+    parser.add_argument('-j', '--jobs', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                       help='Number of videos to convert in parallel (default: half of CPU cores)')
     
     args = parser.parse_args()
     
     # Ensure input file exists
-    input_file = ensure_ext(input_file)
+    input_file = ensure_ext(args.input_file)
     if not os.path.exists(input_file):
         print(f"Error: Input file not found: {input_file}", file=sys.stderr)
         sys.exit(1)
     
-    # Process each line in the input file
+    # Read all paths from the input file, skipping empty lines
     with open(input_file, 'r') as f:
-        for line in f:
-            file_path = line.strip()
-            if file_path:  # Skip empty lines
-                process_file(file_path, args.output_dir, args.upscale)
+        file_paths = [line.strip() for line in f if line.strip()]
+    
+    if args.jobs <= 1:
+        for file_path in file_paths:
+            process_file(file_path, args.output_dir, args.upscale)
+        return
+    
+    # Videos are independent, convert several of them at once.
+    # Each decoder is multi-threaded itself, so by default only half of cores is used.
+    worker = partial(process_file_captured, base_frames_dir=args.output_dir, upscale=args.upscale)
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for output in executor.map(worker, file_paths):
+            print(output, end='')
 
 if __name__ == "__main__":
     main()
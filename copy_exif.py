@@ -13,12 +13,24 @@ the image.
 import argparse
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import piexif
 
+# Exiv2 bindings are optional, they parse large raw files much faster than pure Python piexif
+try:
+    import pyexiv2
+except ImportError:
+    pyexiv2 = None
+
 # Raw file extension (case-insensitive pattern to avoid duplicates on Windows)
 RAW_EXT = "*.[Nn][Ee][Ff]"
 
+# How many bytes from the start of JPG file to scan for EXIF segment
+# (EXIF must be stored before the image data and can't exceed 64 KB)
+JPG_HEADER_SCAN_SIZE = 64 * 1024
+
 # Whitelisted EXIF tags for 0th IFD (Image metadata)
 # Note: Orientation is excluded because JPG files are typically already rotated during processing,
 # while raw files store sensor data with orientation flag. Copying orientation would apply rotation twice.
@@ -76,47 +88,130 @@ EXIF_WHITELIST = [
     piexif.ExifIFD.DigitalZoomRatio,
 ]
 
+# The same whitelists as Exiv2 keys (tag names are the same in piexif and Exiv2)
+EXIV2_WHITELIST = {
+    *(f"Exif.Image.{piexif.TAGS['Image'][tag]['name']}" for tag in EXIF_0TH_WHITELIST),
+    *(f"Exif.Photo.{piexif.TAGS['Exif'][tag]['name']}" for tag in EXIF_WHITELIST),
+}
 
-def find_matching_jpg(raw_path, jpg_dir):
+
+def build_jpg_index(jpg_dir):
     """
-    Find a JPG file that matches the given raw file.
+    Index JPG files of a directory by names of raw files they can match.
     
     JPG files may have the same base name or include suffixes like:
     - DSC_0707.NEF -> DSC_0707.jpg
     - DSC_0707.NEF -> DSC_0707_1.jpg
     - DSC_0707.NEF -> DSC_0707_enhanced.jpg
     
+    So each JPG file is indexed by its lowercase name without extension
+    and by every prefix of the name ending before '_' or '-'.
+    Exact name matches take precedence over the suffixed ones.
+    
     Args:
-        raw_path: Path to the raw file
         jpg_dir: Directory containing JPG files
         
     Returns:
-        Path to matching JPG file or None if not found
+        Dictionary mapping lowercase raw file name (without extension) to JPG file path
     """
-    raw_name = Path(raw_path).stem  # e.g., "DSC_0707"
-    jpg_directory = Path(jpg_dir)
-    
-    # Look for exact match first
-    exact_match = jpg_directory / f"{raw_name}.jpg"
-    if exact_match.exists():
-        return exact_match
-    
-    # Case-insensitive exact match
-    exact_match_upper = jpg_directory / f"{raw_name}.JPG"
-    if exact_match_upper.exists():
-        return exact_match_upper
+    exact = {}
+    suffixed = {}
+    with os.scandir(jpg_dir) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        name, ext = os.path.splitext(entry.name)
+        if ext.lower() != '.jpg' or not entry.is_file():
+            continue
+        key = name.lower()
+        # Prefer lowercase extension, the same as exact match did before
+        if key not in exact or ext == '.jpg':
+            exact[key] = Path(entry.path)
+        for i, ch in enumerate(key):
+            if ch in '_-':
+                suffixed.setdefault(key[:i], Path(entry.path))
+    return {**suffixed, **exact}
+
+
+def find_matching_jpg(raw_path, jpg_index):
+    """
+    Find a JPG file that matches the given raw file.
     
-    # Look for files with suffixes (e.g., DSC_0707_1.jpg, DSC_0707-enhanced.jpg)
-    for jpg_file in jpg_directory.glob(f"{raw_name}[_-]*.[Jj][Pp][Gg]"):
-        return jpg_file
+    Args:
+        raw_path: Path to the raw file
+        jpg_index: JPG files index made by build_jpg_index
+        
+    Returns:
+        Path to matching JPG file or None if not found
+    """
+    return jpg_index.get(Path(raw_path).stem.lower())
+
+
+def find_exif_segment(data):
+    """
+    Find APP1 segment containing EXIF data in the beginning of a JPG file.
     
+    Args:
+        data: Bytes from the start of the JPG file
+        
+    Returns:
+        Tuple (offset, size) of the segment including its marker or None if not found
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan, no more metadata segments
+            return None
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return pos, length + 2
+        pos += 2 + length
     return None
 
 
+def write_exif_in_place(jpg_path, exif_bytes):
+    """
+    Overwrite existing EXIF segment of a JPG file in place when new EXIF data fits into it.
+    The rest of the segment is filled with zeros which EXIF readers ignore.
+    
+    Args:
+        jpg_path: Path to the JPG file
+        exif_bytes: EXIF data as produced by piexif.dump
+        
+    Returns:
+        True if EXIF data has been written, False if the file has to be rewritten instead
+    """
+    with open(jpg_path, 'r+b') as f:
+        segment = find_exif_segment(f.read(JPG_HEADER_SCAN_SIZE))
+        if segment is None:
+            return False
+        offset, size = segment
+        # Segment data follows its marker and length (2 bytes each)
+        capacity = size - 4
+        if len(exif_bytes) > capacity:
+            return False
+        f.seek(offset + 4)
+        f.write(exif_bytes + b'\x00' * (capacity - len(exif_bytes)))
+    return True
+
+
 def jpg_has_exif(jpg_path):
     """
     Check if a JPG file already has EXIF data.
     
+    Only walks JPG segment headers and reads entry counts of IFD0 and IFD1
+    instead of parsing the whole EXIF structure. An EXIF segment without any tags
+    (as some editors write) is not considered as EXIF data. Exif and GPS IFDs
+    are referenced from IFD0, so they can't have tags when IFD0 is empty.
+    
     Args:
         jpg_path: Path to the JPG file
         
@@ -124,15 +219,25 @@ def jpg_has_exif(jpg_path):
         True if JPG has EXIF data, False otherwise
     """
     try:
-        exif_dict = piexif.load(str(jpg_path))
-        # Check if any EXIF IFD has data (excluding thumbnail)
-        has_data = (
-            len(exif_dict.get("0th", {})) > 0 or
-            len(exif_dict.get("Exif", {})) > 0 or
-            len(exif_dict.get("GPS", {})) > 0 or
-            len(exif_dict.get("1st", {})) > 0
-        )
-        return has_data
+        with open(jpg_path, 'rb') as f:
+            data = f.read(JPG_HEADER_SCAN_SIZE)
+        segment = find_exif_segment(data)
+        if segment is None:
+            return False
+        offset, size = segment
+        # TIFF header follows the segment marker, length and Exif identifier
+        tiff = data[offset + 10:offset + size]
+        order = {b'II': 'little', b'MM': 'big'}[tiff[:2]]
+        ifd_offset = int.from_bytes(tiff[4:8], order)
+        for _ in range(2):
+            if ifd_offset == 0 or ifd_offset + 2 > len(tiff):
+                break
+            count = int.from_bytes(tiff[ifd_offset:ifd_offset + 2], order)
+            if count > 0:
+                return True
+            # Offset of the next IFD follows the (empty) list of entries
+            ifd_offset = int.from_bytes(tiff[ifd_offset + 2:ifd_offset + 6], order)
+        return False
     except Exception:
         return False
 
@@ -184,55 +289,88 @@ def copy_exif(raw_path, jpg_path):
         
         # Insert EXIF data into JPG without recompressing
         # This preserves the original JPG quality
-        piexif.insert(exif_bytes, str(jpg_path))
+        # Patch existing EXIF segment when possible to avoid rewriting the whole file
+        if not write_exif_in_place(jpg_path, exif_bytes):
+            piexif.insert(exif_bytes, str(jpg_path))
 
         return None
         
     except Exception as e:
         return f"  ERROR: Failed to copy EXIF data: {e}"
 
-stats = {
-    'processed': 0,
-    'skipped_has_exif': 0,
-    'skipped_no_match': 0,
-    'failed': 0
-}
 
-def process_raw_file(raw_file: Path, jpg_path: Path, force_overwrite: bool, copy_datetime: bool):
+def copy_exif_exiv2(raw_path, jpg_path):
+    """
+    The same as copy_exif but uses Exiv2 library (pyexiv2) for reading and writing EXIF data.
+    
+    Args:
+        raw_path: Path to the source raw image
+        jpg_path: Path to the destination JPG file
+        
+    Returns:
+        None if successful, error message string otherwise
+    """
+    try:
+        # Read EXIF data from raw file
+        with pyexiv2.Image(str(raw_path)) as raw_img:
+            raw_exif = raw_img.read_exif()
+        
+        # Copy whitelisted tags and all GPS tags
+        new_exif = {key: value for key, value in raw_exif.items()
+                    if key in EXIV2_WHITELIST or key.startswith('Exif.GPSInfo.')}
+        
+        # Add comment and ImageDescription about the source
+        comment = f"Copied from {Path(raw_path).name}"
+        new_exif['Exif.Photo.UserComment'] = comment
+        new_exif['Exif.Image.ImageDescription'] = comment
+        
+        # Replace EXIF data of JPG without recompressing
+        with pyexiv2.Image(str(jpg_path)) as jpg_img:
+            jpg_img.clear_exif()
+            jpg_img.modify_exif(new_exif)
+
+        return None
+        
+    except Exception as e:
+        return f"  ERROR: Failed to copy EXIF data: {e}"
+
+
+def process_raw_file(raw_file: Path, jpg_file: Path, force_overwrite: bool, copy_datetime: bool):
     """
     Process raw image and copy EXIF to matching JPG file.
     
     Args:
         raw_file: Path to raw image
-        jpg_path: Path containing processed JPG files
+        jpg_file: Path to matching JPG file or None if there is no match
         force_overwrite: If True, overwrite EXIF even if JPG already has EXIF data
         copy_datetime: If True, copy file creation and modification timestamps
+        
+    Returns:
+        Tuple of status (a key of the summary stats) and list of messages to print
     """
     raw_name = raw_file.name
     msgs = [f"Processing: {raw_name}"]
     #print(f"Processing: {raw_name}")
 
-    # Find matching JPG file
-    jpg_file = find_matching_jpg(raw_file, jpg_path)
-    
     if jpg_file is None:
         #print(f"  SKIPPED: No matching JPG file found")
-        stats['skipped_no_match'] += 1
-        return []
+        return 'skipped_no_match', []
     
     msgs.append(f"  Found JPG: {jpg_file.name}")
     
     # Check if JPG already has EXIF data (unless force_overwrite is enabled)
     if not force_overwrite and jpg_has_exif(jpg_file):
         msgs.append(f"  SKIPPED: JPG already contains EXIF data")
-        stats['skipped_has_exif'] += 1
-        return msgs
+        return 'skipped_has_exif', msgs
     
     # Copy EXIF data
-    res = copy_exif(raw_file, jpg_file)
+    if pyexiv2 is not None:
+        res = copy_exif_exiv2(raw_file, jpg_file)
+    else:
+        res = copy_exif(raw_file, jpg_file)
     if res is None:
         msgs.append(f"  SUCCESS: EXIF data copied to {jpg_file.name}")
-        stats['processed'] += 1
+        status = 'processed'
         
         # Copy file timestamps if requested
         if copy_datetime:
@@ -245,12 +383,12 @@ def process_raw_file(raw_file: Path, jpg_path: Path, force_overwrite: bool, copy
                 msgs.append(f"  WARNING: Failed to copy timestamps: {e}")
     else:
         msgs.append(res)
-        stats['failed'] += 1
+        status = 'failed'
 
-    return msgs
+    return status, msgs
 
 
-def process_directories(raw_dir, jpg_dir, force_overwrite, copy_datetime):
+def process_directories(raw_dir, jpg_dir, force_overwrite, copy_datetime, jobs=None):
     """
     Process all files in the raw directory and copy EXIF to matching JPG files.
     
@@ -259,6 +397,7 @@ def process_directories(raw_dir, jpg_dir, force_overwrite, copy_datetime):
         jpg_dir: Directory containing processed JPG files
         force_overwrite: If True, overwrite EXIF even if JPG already has EXIF data
         copy_datetime: If True, copy file creation and modification timestamps
+        jobs: Number of worker processes (default: number of CPU cores)
     """
     raw_path = Path(raw_dir)
     jpg_path = Path(jpg_dir)
@@ -282,10 +421,43 @@ def process_directories(raw_dir, jpg_dir, force_overwrite, copy_datetime):
     print(f"Found {len(raw_files)} raw files in {raw_dir}")
     print(f"Processing...\n")
     
-    for raw_file in sorted(raw_files):
-        msgs = process_raw_file(raw_file, jpg_path, force_overwrite, copy_datetime)
-        for m in msgs:
-            print(m)
+    # Scan JPG directory only once and match raw files in this process,
+    # so workers receive ready (raw, jpg) pairs
+    jpg_index = build_jpg_index(jpg_path)
+    raw_files = sorted(raw_files)
+    jpg_files = [find_matching_jpg(raw_file, jpg_index) for raw_file in raw_files]
+    
+    stats = {
+        'processed': 0,
+        'skipped_has_exif': 0,
+        'skipped_no_match': 0,
+        'skipped_duplicate': 0,
+        'failed': 0
+    }
+    
+    # Several raw files can match the same JPG (e.g. IMG_1234.NEF and IMG_1234-2.NEF),
+    # workers must not patch one file at the same time, so only the first raw file is used
+    matched_by = {}
+    pairs = []
+    for raw_file, jpg_file in zip(raw_files, jpg_files):
+        if jpg_file is not None:
+            if jpg_file in matched_by:
+                print(f"WARNING: Skipping {raw_file.name}, its JPG {jpg_file.name} "
+                      f"is already matched by {matched_by[jpg_file].name}")
+                stats['skipped_duplicate'] += 1
+                continue
+            matched_by[jpg_file] = raw_file
+        pairs.append((raw_file, jpg_file))
+    
+    # Files are independent and EXIF parsing is CPU-bound pure Python code,
+    # so process them in parallel and aggregate the results here
+    worker = partial(process_raw_file,
+                     force_overwrite=force_overwrite, copy_datetime=copy_datetime)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for status, msgs in executor.map(worker, [raw for raw, _ in pairs], [jpg for _, jpg in pairs], chunksize=8):
+            stats[status] += 1
+            for m in msgs:
+                print(m)
     
     # Print summary
     print("\n" + "=" * 60)
@@ -294,6 +466,7 @@ def process_directories(raw_dir, jpg_dir, force_overwrite, copy_datetime):
     print(f"  Successfully processed: {stats['processed']}")
     print(f"  Skipped (already has EXIF): {stats['skipped_has_exif']}")
     print(f"  Skipped (no matching JPG): {stats['skipped_no_match']}")
+    print(f"  Skipped (JPG matched by another raw file): {stats['skipped_duplicate']}")
     print(f"  Failed: {stats['failed']}")
     print("=" * 60)
 
@@ -310,6 +483,7 @@ Examples:
   python copy_exif.py ./raw_photos ./processed_photos --force
   python copy_exif.py ./raw_photos ./processed_photos --datetime
   python copy_exif.py ./raw_photos ./processed_photos --force --datetime
+  python copy_exif.py ./raw_photos ./processed_photos --jobs 4
         """
     )
     
@@ -337,9 +511,16 @@ Examples:
         help='Copy file creation and modification timestamps from raw to JPG'
     )
     
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        help='Number of files to process in parallel (default: number of CPU cores)'
+    )
+    
     args = parser.parse_args()
     
-    process_directories(args.raw_dir, args.jpg_dir, args.force, args.datetime)
+    process_directories(args.raw_dir, args.jpg_dir, args.force, args.datetime, args.jobs)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,23 @@
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageOps
-from skimage import exposure
+from PIL import Image, ImageEnhance, ImageOps, ImageStat
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
-def enhance_with_opencv(image_path, output_path):
+def enhance_with_opencv(image_path, output_path, strong_denoise=False):
     """
-    Enhance image using OpenCV with automatic color correction and contrast enhancement
+    Enhance image using OpenCV with automatic color correction and contrast enhancement.
+    Uses cheap edge-preserving bilateral filter for denoising unless strong_denoise is set,
+    then much slower non-local means denoising is applied.
     """
     # Read image
     img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    
+    # Upload to UMat so the pipeline runs on OpenCL device when available (falls back to CPU)
+    img = cv2.UMat(img)
     
     # Convert to LAB color space
     lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
@@ -28,10 +36,29 @@ def enhance_with_opencv(image_path, output_path):
     enhanced = cv2.cvtColor(merged, cv2.COLOR_LAB2BGR)
     
     # Denoise
-    enhanced = cv2.fastNlMeansDenoisingColored(enhanced)
+    if strong_denoise:
+        enhanced = cv2.fastNlMeansDenoisingColored(enhanced)
+    else:
+        enhanced = cv2.bilateralFilter(enhanced, d=7, sigmaColor=35, sigmaSpace=7)
     
-    # Save result
-    cv2.imwrite(output_path, enhanced)
+    # Download result and save
+    cv2.imwrite(output_path, enhanced.get())
+
+def contrast_brightness_lut(img, contrast, brightness):
+    """
+    Build lookup table doing the same as ImageEnhance.Contrast followed by ImageEnhance.Brightness.
+    Both are per-channel blends with a constant image, so they can be applied in a single pass.
+    """
+    # The same mean gray level as ImageEnhance.Contrast uses
+    mean = int(ImageStat.Stat(img.convert("L")).mean[0] + 0.5)
+    # Compute in float32 with truncation exactly like Image.blend does
+    x = np.arange(256, dtype=np.float32)
+    x = np.clip(np.trunc(np.float32(mean) + np.float32(contrast) * (x - np.float32(mean))), 0, 255)
+    x = np.clip(np.trunc(np.float32(brightness) * x), 0, 255)
+    lut = x.astype(np.uint8).tolist()
+    # Alpha channel is left untouched by both enhancers
+    identity = list(range(256))
+    return [v for band in img.getbands() for v in (identity if band == 'A' else lut)]
 
 def enhance_with_pillow(image_path, output_path):
     """
@@ -47,13 +74,13 @@ def enhance_with_pillow(image_path, output_path):
     enhancer = ImageEnhance.Color(img)
     img = enhancer.enhance(1.2)  # Increase color saturation by 20%
     
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(1.1)  # Increase contrast by 10%
-    
-    # Enhance brightness
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(1.1)  # Increase brightness by 10%
+    # Enhance contrast and brightness
+    if img.mode in ('L', 'RGB', 'RGBA'):
+        # Increase contrast by 10% and brightness by 10% in one pass
+        img = img.point(contrast_brightness_lut(img, 1.1, 1.1))
+    else:
+        img = ImageEnhance.Contrast(img).enhance(1.1)
+        img = ImageEnhance.Brightness(img).enhance(1.1)
     
     # Enhance sharpness
     enhancer = ImageEnhance.Sharpness(img)
@@ -64,25 +91,29 @@ def enhance_with_pillow(image_path, output_path):
 
 def enhance_with_skimage(image_path, output_path):
     """
-    Enhance image using scikit-image with advanced histogram equalization
+    Enhance image with adaptive histogram equalization and gamma correction.
+    Reproduces the former scikit-image method (equalize_adapthist + adjust_gamma)
+    entirely in uint8 with OpenCV instead of float64 processing.
     """
     # Read image
     img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
     
-    # Convert to RGB
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # Perform adaptive histogram equalization of the V channel in HSV color space
+    # like equalize_adapthist does for color images, the clip limit is scaled
+    # from normalized 0.03 to OpenCV's units (relative to 256 histogram bins)
+    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    clahe = cv2.createCLAHE(clipLimit=0.03 * 256, tileGridSize=(8,8))
+    img_adapted = cv2.cvtColor(cv2.merge((h, s, clahe.apply(v))), cv2.COLOR_HSV2BGR)
     
-    # Perform adaptive histogram equalization
-    img_adapted = exposure.equalize_adapthist(img_rgb, clip_limit=0.03)
+    # Adjust gamma via lookup table
+    lut = (np.power(np.arange(256) / 255.0, 1.2) * 255).astype(np.uint8)
+    img_final = cv2.LUT(img_adapted, lut)
     
-    # Adjust gamma
-    img_gamma = exposure.adjust_gamma(img_adapted, 1.2)
-    
-    # Convert back to BGR and save
-    img_final = cv2.cvtColor((img_gamma * 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
     cv2.imwrite(output_path, img_final)
 
-def enhance_photo(input_path, output_dir="enhanced"):
+def enhance_photo(input_path, output_dir="enhanced", strong_denoise=False):
     """
     Apply all enhancement methods and save results
     """
@@ -93,31 +124,52 @@ def enhance_photo(input_path, output_dir="enhanced"):
     filename = os.path.splitext(os.path.basename(input_path))[0]
     
     # Apply each enhancement method
-    try:
-        enhance_with_opencv(input_path, os.path.join(output_dir, f"{filename}_opencv.jpg"))
-        print(f"OpenCV enhancement saved for {filename}")
-    except Exception as e:
-        print(f"OpenCV enhancement failed: {e}")
-    
-    try:
-        enhance_with_pillow(input_path, os.path.join(output_dir, f"{filename}_pillow.jpg"))
-        print(f"Pillow enhancement saved for {filename}")
-    except Exception as e:
-        print(f"Pillow enhancement failed: {e}")
-    
-    try:
-        enhance_with_skimage(input_path, os.path.join(output_dir, f"{filename}_skimage.jpg"))
-        print(f"Scikit-image enhancement saved for {filename}")
-    except Exception as e:
-        print(f"Scikit-image enhancement failed: {e}")
+    # Pillow runs in a separate thread overlapping with OpenCV methods,
+    # both release GIL for heavy pixel processing
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pillow_future = executor.submit(
+            enhance_with_pillow, input_path, os.path.join(output_dir, f"{filename}_pillow.jpg"))
+        
+        try:
+            enhance_with_opencv(input_path, os.path.join(output_dir, f"{filename}_opencv.jpg"), strong_denoise)
+            print(f"OpenCV enhancement saved for {filename}")
+        except Exception as e:
+            print(f"OpenCV enhancement failed: {e}")
+        
+        try:
+            enhance_with_skimage(input_path, os.path.join(output_dir, f"{filename}_skimage.jpg"))
+            print(f"Scikit-image enhancement saved for {filename}")
+        except Exception as e:
+            print(f"Scikit-image enhancement failed: {e}")
+        
+        try:
+            pillow_future.result()
+            print(f"Pillow enhancement saved for {filename}")
+        except Exception as e:
+            print(f"Pillow enhancement failed: {e}")
+
+def enhance_many(input_paths, output_dir="enhanced", strong_denoise=False, jobs=None):
+    """
+    Enhance several photos in parallel processes
+    """
+    worker = partial(enhance_photo, output_dir=output_dir, strong_denoise=strong_denoise)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        list(executor.map(worker, input_paths))
 
 if __name__ == "__main__":
-    # Example usage
-    import sys
-    if len(sys.argv) > 1:
-        input_image = sys.argv[1]
-        enhance_photo(input_image)
-        print(f"\nEnhanced versions have been saved in the 'enhanced' directory")
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Enhance photos using several methods')
+    parser.add_argument('input', nargs='+', help='Paths to the images')
+    parser.add_argument('--strong-denoise', action='store_true',
+                       help='Use slow non-local means denoising in OpenCV method instead of bilateral filter')
+    parser.add_argument('-j', '--jobs', type=int,
+                       help='Number of images to process in parallel (default: number of CPU cores)')
+    
+    args = parser.parse_args()
+    
+    if len(args.input) == 1:
+        enhance_photo(args.input[0], strong_denoise=args.strong_denoise)
     else:
-        print("Please provide an image path as argument")
-        print("Usage: python enhance_photos.py path/to/image.jpg")
+        enhance_many(args.input, strong_denoise=args.strong_denoise, jobs=args.jobs)
+    print(f"\nEnhanced versions have been saved in the 'enhanced' directory")
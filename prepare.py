@@ -1,10 +1,11 @@
 import os
 import sys
 import argparse
+import contextlib
 
 from utils import ensure_ext, DEF_EXT
 
-# Configure how often to report progress and save files
+# Configure how often to report progress
 PROGRESS_INTERVAL = 100
 
 # Common media file extensions (excluding jpg/jpeg)
@@ -15,45 +16,67 @@ MEDIA_EXTENSIONS = {
     '.mp4', '.mov', '.avi', '.wmv', '.flv', '.mkv', '.webm', '.m4v', '.mpg', '.mpeg'
 }
 
-def has_jpg_counterpart(file_path):
-    """Check if there's a jpg version of the file in the same directory."""
-    dirname = os.path.dirname(file_path)
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    
-    # Get list of all files in directory
-    dir_files = os.listdir(dirname)
-    
-    # Convert filename to lowercase for case-insensitive comparison
-    filename_lower = filename.lower()
+# Extension tuples for fast str.endswith checks
+JPG_EXTS = ('.jpg', '.jpeg')
+MEDIA_EXTS = tuple(MEDIA_EXTENSIONS)
+
+# Service directories of OS and NAS software that never contain user media
+# (hidden directories starting with '.' are skipped as well)
+SKIP_DIRS = {'@eaDir', '#recycle', '$RECYCLE.BIN', 'System Volume Information'}
+
+def scan_directory(directory):
+    """Recursively yield (directory, entries) pairs, one for each directory in the tree."""
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError as e:
+        print(f"Warning: Can't read directory '{directory}': {e}", file=sys.stderr)
+        return
     
-    # Check for any jpg/jpeg file that matches our filename (case-insensitive)
-    for file in dir_files:
-        name, ext = os.path.splitext(file)
-        if (name.lower() == filename_lower and 
-            ext.lower() in ('.jpg', '.jpeg')):
-            return True
+    yield directory, entries
     
-    return False
+    # Don't descend into directory symlinks, the same as os.walk does
+    for entry in entries:
+        if entry.name.startswith('.') or entry.name in SKIP_DIRS:
+            continue
+        if entry.is_dir() and not entry.is_symlink():
+            yield from scan_directory(entry.path)
 
-def process_directory(directory, jpg_files, non_jpg_files, non_photos_file):
-    """Process a single directory and update the file lists."""
+def process_directory(directory, photos_out, non_photos_out, counts):
+    """
+    Process a single directory, write found files to the output files
+    as soon as they are found and update counters of found files.
+    """
     files_processed = 0
     
     # Walk through directory recursively
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for filename in filenames:
-            # Get file extension in lowercase
-            ext = os.path.splitext(filename)[1].lower()
-            absolute_path = os.path.abspath(os.path.join(dirpath, filename))
+    for dirpath, entries in scan_directory(directory):
+        files = [entry for entry in entries if not entry.is_dir()]
+        abs_dirpath = os.path.abspath(dirpath)
+        
+        # Names (lowercase, without extension) of all JPG files in the directory,
+        # used to check if a non-JPG media file has a JPG counterpart
+        jpg_stems = set()
+        if non_photos_out:
+            for entry in files:
+                lower = entry.name.lower()
+                if lower.endswith(JPG_EXTS):
+                    jpg_stems.add(lower[:lower.rfind('.')])
+        
+        for entry in files:
+            # Compare extensions in lowercase
+            lower = entry.name.lower()
             
-            if ext in ('.jpg', '.jpeg'):
+            if lower.endswith(JPG_EXTS):
                 # Add JPG files to photos list
-                jpg_files.append(absolute_path)
-            elif ext in MEDIA_EXTENSIONS and non_photos_file:
+                photos_out.write(os.path.join(abs_dirpath, entry.name) + "\n")
+                counts['jpg'] += 1
+            elif non_photos_out and lower.endswith(MEDIA_EXTS):
                 # For non-JPG media files, check if they have JPG counterparts
                 # Only process if non_photos_file is specified
-                if not has_jpg_counterpart(absolute_path):
-                    non_jpg_files.append(absolute_path)
+                if lower[:lower.rfind('.')] not in jpg_stems:
+                    non_photos_out.write(os.path.join(abs_dirpath, entry.name) + "\n")
+                    counts['non_jpg'] += 1
             
             files_processed += 1
             if files_processed % PROGRESS_INTERVAL == 0:
@@ -63,38 +86,38 @@ def process_directory(directory, jpg_files, non_jpg_files, non_photos_file):
     return files_processed
 
 def find_media_files(root_path, photos_file, non_photos_file):
-    """Find both JPG files and non-JPG media files without JPG counterparts."""
-    jpg_files = []
-    non_jpg_files = []
+    """
+    Find both JPG files and non-JPG media files without JPG counterparts.
+    Found files are streamed into the target files during the scan.
+    """
+    counts = {'jpg': 0, 'non_jpg': 0}
     total_files_processed = 0
     
-    if os.path.isfile(root_path):
-        # If root_path is a file, read directories from it
-        with open(root_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                # Skip empty lines and comments
-                if not line or line.startswith('#'):
-                    continue
-                    
-                if os.path.exists(line) and os.path.isdir(line):
-                    print(f"\nProcessing directory: {line}")
-                    files_processed = process_directory(line, jpg_files, non_jpg_files, non_photos_file)
-                    total_files_processed += files_processed
-                else:
-                    print(f"Warning: '{line}' is not a valid directory, skipping", file=sys.stderr)
-    else:
-        # Process single directory
-        print(f"\nProcessing directory: {root_path}")
-        total_files_processed = process_directory(root_path, jpg_files, non_jpg_files, non_photos_file)
+    with contextlib.ExitStack() as stack:
+        photos_out = stack.enter_context(open(photos_file, "w"))
+        non_photos_out = stack.enter_context(open(non_photos_file, "w")) if non_photos_file else None
+        
+        if os.path.isfile(root_path):
+            # If root_path is a file, read directories from it
+            with open(root_path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    # Skip empty lines and comments
+                    if not line or line.startswith('#'):
+                        continue
+                        
+                    if os.path.exists(line) and os.path.isdir(line):
+                        print(f"\nProcessing directory: {line}")
+                        files_processed = process_directory(line, photos_out, non_photos_out, counts)
+                        total_files_processed += files_processed
+                    else:
+                        print(f"Warning: '{line}' is not a valid directory, skipping", file=sys.stderr)
+        else:
+            # Process single directory
+            print(f"\nProcessing directory: {root_path}")
+            total_files_processed = process_directory(root_path, photos_out, non_photos_out, counts)
     
-    return jpg_files, non_jpg_files, total_files_processed
-
-def save_results(file_list, target_file):
-    """Save the list of files to the target file."""
-    with open(target_file, "w") as f:
-        for file_path in file_list:
-            f.write(file_path + "\n")
+    return counts['jpg'], counts['non_jpg'], total_files_processed
 
 def main():
     parser = argparse.ArgumentParser(
@@ -113,20 +136,15 @@ def main():
         print(f"Error: Path '{args.root_path}' does not exist", file=sys.stderr)
         sys.exit(1)
     
-    # Find all media files
+    # Find all media files and save them
     output_file = ensure_ext(args.output_file)
     non_photos_file = ensure_ext(args.non_photos)
-    jpg_files, non_jpg_files, total_processed = find_media_files(args.root_path, output_file, non_photos_file)
-    
-    # Save final results
-    save_results(jpg_files, output_file)
-    if non_photos_file:
-        save_results(non_jpg_files, non_photos_file)
+    jpg_count, non_jpg_count, total_processed = find_media_files(args.root_path, output_file, non_photos_file)
     
     print(f"\nCompleted! Total files processed: {total_processed}")
-    print(f"Total JPG files found: {len(jpg_files)}")
+    print(f"Total JPG files found: {jpg_count}")
     if non_photos_file:
-        print(f"Total non-JPG media files found: {len(non_jpg_files)}")
+        print(f"Total non-JPG media files found: {non_jpg_count}")
         print(f"Non-JPG media files saved to: {non_photos_file}")
     print(f"JPG files saved to: {output_file}")
 
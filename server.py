@@ -1,12 +1,17 @@
-from flask import Flask, jsonify, send_file, abort
+from flask import Flask, send_file, abort, request
 import os
+import json
 import mimetypes
 import argparse
+import threading
 from PIL import Image, ExifTags
 from datetime import datetime
 
 from utils import ensure_ext
 
+# How long clients may reuse a fetched image without revalidation, in seconds
+IMAGE_MAX_AGE = 24 * 60 * 60
+
 def get_image_date(image_path):
     """Extract date from image EXIF data or file modification time"""
     try:
@@ -41,52 +46,125 @@ def get_image_date(image_path):
         # If all fails, return a very old date so the file appears at the start
         return datetime.min
 
+def prefetch_file(path):
+    """Ask the OS to read the whole file into page cache in background (Linux only)"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def load_images(paths):
+    """
+    Validate image paths and precompute content types to serve them.
+    Returns a list of (path, content type) tuples.
+    """
+    images = []
+    for path in paths:
+        content_type = mimetypes.guess_type(path)[0]
+        if not content_type or not content_type.startswith('image/'):
+            print(f"Skipping invalid image file: {path}")
+            continue
+        if not os.path.exists(path):
+            print(f"Image not found: {path}")
+            continue
+        images.append((path, content_type))
+    return images
+
 app = Flask(__name__)
 
 # Store slideshow configurations
 slideshows = {}
+# Image lists of slideshows serialized once on loading,
+# both as JSON and as newline-delimited text, keyed by content type
+slideshow_lists = {}
+LIST_MIMETYPES = ['application/json', 'text/plain']
+# Locks of slideshows being loaded, so that concurrent first requests load a list once
+slideshow_locks = {}
+
+def load_slideshow(key):
+    """Load slideshow images and serialize their list, returns (lists by content type, images)"""
+    photos_file = ensure_ext(key)
+    if not os.path.exists(photos_file):
+        abort(404, description=f"Slideshow '{key}' not found")
+    try:
+        with open(photos_file, 'r') as f:
+            images = load_images(f.read().splitlines())
+        # Sort images by image date
+        images.sort(key=lambda image: get_image_date(image[0]))
+        paths = [image[0] for image in images]
+        lists = {
+            'application/json': json.dumps(paths).encode(),
+            'text/plain': ''.join(path + '\n' for path in paths).encode(),
+        }
+        print(f"Slideshow '{key}' loaded, image paths: {len(images)}")
+        return lists, images
+    except Exception as e:
+        print(f"Error loading image list '{photos_file}': {e}")
+        abort(500, description=f"Error loading image list for slideshow '{key}': {e}")
 
 @app.route('/api/slideshow/<key>/list')
 def get_image_list(key):
     """Load and return the list of images for a slideshow"""
-    if key not in slideshows:
-        try:
-            photos_file = ensure_ext(key)
-            if not os.path.exists(photos_file):
-                abort(404, description=f"Slideshow '{key}' not found")
-            with open(photos_file, 'r') as f:
-                paths = f.read().splitlines()
-                # Sort paths by image date
-                paths.sort(key=lambda path: get_image_date(path))
-                slideshows[key] = paths
-                print(f"Slideshow '{key}' loaded, image paths: {len(paths)}")
-        except Exception as e:
-            print(f"Error loading image list '{photos_file}': {e}")
-            abort(500, description=f"Error loading image list for slideshow '{key}': {e}")
-    return jsonify(slideshows[key])
+    lists = slideshow_lists.get(key)
+    if lists is None:
+        # Requests are served in several threads, only one of them loads the list
+        with slideshow_locks.setdefault(key, threading.Lock()):
+            lists = slideshow_lists.get(key)
+            if lists is None:
+                lists, images = load_slideshow(key)
+                # Lists first, the check above relies on them,
+                # images are published after everything is ready
+                slideshow_lists[key] = lists
+                slideshows[key] = images
+    # JSON is returned unless client asks for text explicitly
+    mimetype = request.accept_mimetypes.best_match(LIST_MIMETYPES, default='application/json')
+    response = app.response_class(lists[mimetype], mimetype=mimetype)
+    # Tell HTTP caches the body depends on Accept header, so JSON and text are cached separately
+    response.vary.add('Accept')
+    return response
 
 @app.route('/api/slideshow/<key>/image/<image_index>')
 def get_image(key, image_index):
     """Return an image file content by index"""
     if key not in slideshows:
         abort(404, description=f"Slideshow '{key}' not found")
+    images = slideshows[key]
     try:
-        image_paths = slideshows[key]
         image_index = int(image_index)
-        if image_index < 0 or image_index >= len(image_paths):
-            abort(404, description=f"Image not found: {image_index}")
-        image_path = image_paths[image_index]
-        if not os.path.isfile(image_path):
-            print(f"Image not found: {image_path}")
-            abort(404, description=f"Image not found: {image_index}")
+    except ValueError:
+        abort(404, description=f"Image not found: {image_index}")
+    if image_index < 0 or image_index >= len(images):
+        abort(404, description=f"Image not found: {image_index}")
+    
+    image_path, content_type = images[image_index]
+    try:
+        # Files can be changed while the server runs (e.g. by copy_exif),
+        # so their version is checked on each request, a single stat() is cheap
+        st = os.stat(image_path)
+        etag = f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}"
         
-        # Determine content type
-        content_type = mimetypes.guess_type(image_path)[0]
-        if not content_type or not content_type.startswith('image/'):
-            abort(400, description=f"Invalid image file: {image_path}")
+        # Issue read of the whole file at once instead of growing readahead
+        # while the response is streamed in small chunks,
+        # HEAD requests of clients checking their caches don't need the content
+        if request.method != 'HEAD' and not request.if_none_match.contains(etag):
+            prefetch_file(image_path)
         
-        return send_file(image_path, mimetype=content_type)
+        # Let clients cache images and revalidate them cheaply,
+        # conditional requests get 304 Not Modified without reading the file.
+        # File content is not cached in the process: all server threads read
+        # through the OS page cache, keeping another copy would only waste memory
+        return send_file(image_path, mimetype=content_type, conditional=True,
+                         etag=etag, last_modified=st.st_mtime, max_age=IMAGE_MAX_AGE)
     
+    except FileNotFoundError:
+        print(f"Image not found: {image_path}")
+        abort(404, description=f"Image not found: {image_index}")
     except Exception as e:
         print(f"Error loading image {image_index} for slideshow '{key}': {e}")
         abort(500, description=str(e))
@@ -98,12 +176,26 @@ def main():
     parser.add_argument('--port', type=int, default=5000,
                       help='Port to listen on (default: 5000)')
     parser.add_argument('--debug', action='store_true',
-                      help='Run in debug mode')
+                      help='Run in debug mode (uses Flask development server)')
+    parser.add_argument('--threads', type=int, default=16,
+                      help='Number of threads serving requests (default: 16)')
     
     args = parser.parse_args()
     
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+    
     # Run the server
-    app.run(host=args.host, port=args.port, debug=args.debug)
+    # Use production server so slow disk reads of one image don't block other requests
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress is not installed, falling back to Flask development server")
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+    print(f"Serving on http://{args.host}:{args.port} with {args.threads} threads")
+    serve(app, host=args.host, port=args.port, threads=args.threads)
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,18 @@
 import tkinter as tk
-from PIL import Image, ImageTk, ExifTags
+from PIL import Image, ImageTk, ImageOps, ExifTags
 import random
 import configparser
 import os
 from datetime import datetime
 import threading
-from queue import Queue
+import time
+import itertools
+import hashlib
+from collections import OrderedDict
+from queue import PriorityQueue
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 from io import BytesIO
 
@@ -26,6 +31,50 @@ DIRNAME_PANEL_MARGIN = 20
 DIRNAME_PANEL_PADDING = 15
 DIRNAME_PANEL_HEIGHT = 60
 MAX_ERROR_COUNT = 5
+# How long to wait before loading again after too many errors in a row, seconds
+ERROR_COOLDOWN = 30
+PRELOAD_THREADS = 3
+PRELOAD_DEPTH = 3
+# Total size of decoded images kept in cache, bytes
+# (the only image rendered for display is kept outside of the cache by the UI thread)
+CACHE_BYTE_BUDGET = 256 * 1024 * 1024
+# Connect and read timeouts of server requests, seconds
+HTTP_TIMEOUT = (2, 10)
+# Where images fitted to screen are stored between runs
+THUMBS_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'flashback', 'thumbs')
+# Total size of images kept in THUMBS_DIR, least recently used are deleted above it
+THUMBS_BYTE_BUDGET = 2 * 1024 * 1024 * 1024
+# Priorities of background loading, lower is loaded first
+PRIORITY_SHOW = 0
+PRIORITY_PRELOAD = 10
+# EXIF tags that might contain date information, in order of preference
+DATE_TAGS = (ExifTags.Base.DateTimeOriginal, ExifTags.Base.DateTimeDigitized, ExifTags.Base.DateTime)
+
+def prune_thumbnails():
+    """Delete least recently used images fitted to screen when they take too much space"""
+    files = []
+    total = 0
+    try:
+        with os.scandir(THUMBS_DIR) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+    except OSError as e:
+        print(f"Error scanning cached images: {e}")
+        return
+    
+    # Used images are touched, so modification time is the time of last use
+    files.sort()
+    for _, size, path in files:
+        if total <= THUMBS_BYTE_BUDGET:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
 
 class Slideshow:
     def __init__(self, root, photos_file, server_url):
@@ -34,24 +83,69 @@ class Slideshow:
         self.photos_file = photos_file
         self.server_url = server_url
         self.error_count = 0
+        # Time until which loading is not attempted after too many errors
+        self.error_cooldown = 0
         self.current_year = None
         
-        # Image cache dictionary
-        self.image_cache = {}
-        self.cache_size = 5  # Keep last N images in cache
-        
-        # Queue for background loading
-        self.load_queue = Queue()
-        self.loading_thread = threading.Thread(target=self.background_loader, daemon=True)
-        self.loading_thread.start()
+        # Image cache dictionary, maps image index to a dictionary of loaded image and its year,
+        # entries are kept in order of use, the least recently used goes first
+        self.image_cache = OrderedDict()
+        # Total size of decoded images in cache, the cache is limited by it rather than
+        # by number of entries as images of different resolution take very different memory
+        self.cache_bytes = 0
+        
+        # PhotoImage rendered for the display from the shown image, and (image, display size)
+        # it was rendered from. Tk objects must be created and released only in the UI thread,
+        # so they are not kept in the cache which is also changed by loader threads
+        self.photo = None
+        self.photo_source = None
+        
+        # Directory for images fitted to screen kept between runs
+        os.makedirs(THUMBS_DIR, exist_ok=True)
+        # Trim it in background, listing a large directory takes time
+        threading.Thread(target=prune_thumbnails, daemon=True).start()
+        # Bytes written to it since it was trimmed last time
+        self.thumbs_written = 0
+        
+        # Reuse server connections for all requests instead of connecting for each image
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=2)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        # Images are compressed already, don't make server spend time on gzip
+        self.http.headers.update({'Connection': 'keep-alive', 'Accept-Encoding': 'identity'})
+        
+        # Guards image cache and indexes being loaded in background
+        self.cache_lock = threading.Lock()
+        # Indexes queued for loading
+        self.inflight = set()
+        # Indexes taken from the queue and being loaded right now
+        self.loading = set()
+        # Index of image to be shown as soon as it's loaded
+        self.waiting_index = None
+        
+        # Queue for background loading, served by several threads
+        # so that slow fetches of different images overlap.
+        # Items are (priority, counter, index), counter keeps FIFO order within priority
+        self.load_queue = PriorityQueue()
+        self.load_counter = itertools.count()
+        self.loading_threads = []
+        for _ in range(PRELOAD_THREADS):
+            thread = threading.Thread(target=self.background_loader, daemon=True)
+            thread.start()
+            self.loading_threads.append(thread)
         
         # Store start timestamp for bad images log
         self.start_timestamp = datetime.now()
         self.bad_images_file = None
+        self.bad_images_log = None
 
         self.root = root
         self.root.title("Photo Slideshow")
         
+        # Images are never displayed larger than the screen
+        self.screen_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        
         # Load settings before configuring window
         self.config = configparser.ConfigParser()
         self.load_settings()
@@ -81,7 +175,7 @@ class Slideshow:
         self.main_frame.pack(fill=tk.BOTH, expand=True)
         
         # Create label for displaying images with black background
-        self.label = tk.Label(self.main_frame, bg='black')
+        self.label = tk.Label(self.main_frame, bg='black', fg='gray', font=('Arial', 24))
         self.label.pack(fill=tk.BOTH, expand=True)
         
         # Create a toplevel window for the buttons
@@ -104,6 +198,9 @@ class Slideshow:
         self.button_window.withdraw()
         
         # Bind mouse motion and window resize
+        # Last seen window geometry and pending job handling its change
+        self.last_configure = None
+        self.configure_job = None
         self.root.bind('<Motion>', self.check_mouse_position)
         self.root.bind('<Configure>', self.on_window_configure)
         
@@ -169,13 +266,18 @@ class Slideshow:
 
     def load_file_list(self):
         image_paths = []
-        self.image_paths = []
         print(f"Loading image paths from {self.photos_file}...")
         if self.server_url:
             try:
-                response = requests.get(f"{self.server_url}/api/slideshow/{self.photos_file}/list")
+                # Newline-delimited list is parsed line by line while it's being received,
+                # older servers may still return JSON
+                url = f"{self.server_url}/api/slideshow/{self.photos_file}/list"
+                response = self.http.get(url, headers={'Accept': 'text/plain'}, stream=True, timeout=HTTP_TIMEOUT)
                 if response.ok:
-                    image_paths = response.json()
+                    if response.headers.get('Content-Type', '').startswith('application/json'):
+                        image_paths = response.json()
+                    else:
+                        image_paths = [line.decode('utf-8') for line in response.iter_lines() if line]
                 else:
                     raise Exception(f"Failed to get image list from server: {response.status_code}")
             except Exception as e:
@@ -188,10 +290,9 @@ class Slideshow:
         # In remote mode images are loaded by indexes but 
         # paths are still required to display image name
         
-        self.image_indexes = [*range(len(image_paths))]
-        random.shuffle(self.image_indexes)
-        for index in self.image_indexes:
-            self.image_paths.append(image_paths[index])
+        count = len(image_paths)
+        self.image_indexes = random.sample(range(count), count)
+        self.image_paths = [image_paths[index] for index in self.image_indexes]
         print(f"Loaded image paths: {len(self.image_paths)}")
 
     def create_toolbutton(self, text, command):
@@ -211,9 +312,18 @@ class Slideshow:
         window_width = self.root.winfo_width()
         window_height = self.root.winfo_height()
         
+        # Check which panels the mouse is over
+        in_toolbar = event.x < TOOLBAR_WIDTH + TOOLBAR_MARGIN and \
+            event.y < TOOLBAR_HEIGHT + TOOLBAR_MARGIN
+        in_filename = event.x > window_width - 1000 and \
+            event.y > window_height - FILENAME_PANEL_HEIGHT - FILENAME_PANEL_MARGIN
+        
+        # Nothing to do until the mouse enters or leaves a panel
+        if in_toolbar == self.button_visible and in_filename == self.label_visible:
+            return
+        
         # Show button window if mouse is in upper-right corner
-        if event.x < TOOLBAR_WIDTH + TOOLBAR_MARGIN and \
-           event.y < TOOLBAR_HEIGHT + TOOLBAR_MARGIN:
+        if in_toolbar:
 
             # Position window relative to main window
             root_x = self.root.winfo_x()
@@ -232,8 +342,7 @@ class Slideshow:
                 self.button_visible = False
         
         # Show filename if mouse is in bottom-right corner
-        if event.x > window_width - 1000 and \
-            event.y > window_height - FILENAME_PANEL_HEIGHT - FILENAME_PANEL_MARGIN:
+        if in_filename:
             if not self.label_visible:
                 # Get current file path and name
                 current_path = self.image_paths[self.current_index]
@@ -279,52 +388,125 @@ class Slideshow:
             self.root.after_cancel(self.timer_id)
             self.timer_id = None
 
+    def read_image(self, index):
+        """Read image from disk or server and fit it into screen"""
+        if self.server_url:
+            origin_index = self.image_indexes[index]
+            url = f"{self.server_url}/api/slideshow/{self.photos_file}/image/{origin_index}"
+            try:
+                # Fail fast when server is down, but let it take time to send a large image
+                response = self.http.get(url, timeout=HTTP_TIMEOUT)
+                if response.ok:
+                    image = Image.open(BytesIO(response.content))
+                else:
+                    raise Exception(f"Server returned status code: {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Network error: {e}")
+        else:
+            image = Image.open(self.image_paths[index])
+        
+        # Let JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+        # so that the image is still not smaller than the screen
+        image.draft('RGB', self.screen_size)
+        
+        image = self.apply_exif_orientation(image)
+        
+        # Fit image into screen once here, so displaying it only takes a small resize
+        image.thumbnail(self.screen_size, self.resample)
+        return image
+
+    def get_image_etag(self, index):
+        """Ask server for the ETag of an image without downloading it"""
+        origin_index = self.image_indexes[index]
+        url = f"{self.server_url}/api/slideshow/{self.photos_file}/image/{origin_index}"
+        try:
+            response = self.http.head(url, timeout=HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Network error: {e}")
+        if not response.ok:
+            raise Exception(f"Server returned status code: {response.status_code}")
+        return response.headers.get('ETag')
+
+    def get_thumbnail_path(self, index):
+        """Return path of cached image fitted to screen, or None if it can't be cached"""
+        path = self.image_paths[index]
+        if self.server_url:
+            # Image version is only known to the server, an image changed there gets new ETag
+            etag = self.get_image_etag(index)
+            if not etag:
+                return None
+            source = f"{self.server_url}:{path}:{etag}"
+        else:
+            try:
+                source = f"{path}:{os.path.getmtime(path)}"
+            except OSError:
+                return None
+        key = f"{source}:{self.screen_size[0]}x{self.screen_size[1]}:{self.resample_name}"
+        name = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+        return os.path.join(THUMBS_DIR, name + '.webp')
+
     def load_image_sync(self, index):
-        """Load image synchronously and return it"""
+        """Load image synchronously, put it into cache and return the cache entry"""
+        # Don't even try while server is likely unreachable
+        if time.monotonic() < self.error_cooldown:
+            return None
         try:
-            if self.server_url:
-                origin_index = self.image_indexes[index]
-                url = f"{self.server_url}/api/slideshow/{self.photos_file}/image/{origin_index}"
+            # Images fitted to screen are kept on disk between runs,
+            # so they are not decoded or downloaded again
+            thumb_path = self.get_thumbnail_path(index)
+            image = None
+            if thumb_path and os.path.exists(thumb_path):
                 try:
-                    response = requests.get(url, timeout=10)  # 10 second timeout
-                    if response.ok:
-                        image = Image.open(BytesIO(response.content))
-                    else:
-                        raise Exception(f"Server returned status code: {response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    raise Exception(f"Network error: {e}")
-            else:
-                image = Image.open(self.image_paths[index])
-            
-            image = self.apply_exif_orientation(image)
-            self.current_year = self.extract_year_from_exif(image)
-            self.image_cache[index] = image
+                    image = Image.open(thumb_path)
+                    image.load()
+                    # Mark as recently used so it's not pruned
+                    os.utime(thumb_path)
+                except Exception as e:
+                    print(f"Error reading cached image {thumb_path}: {e}")
+                    image = None
+            if image is None:
+                image = self.read_image(index)
+                if thumb_path:
+                    try:
+                        # Keep EXIF for the year, write to temporary file
+                        # so that other threads never see partially written image
+                        temp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+                        image.save(temp_path, 'WEBP', quality=85, exif=image.getexif())
+                        os.replace(temp_path, thumb_path)
+                        self.thumbs_written += os.path.getsize(thumb_path)
+                        # Trim cache again during long shows of large libraries
+                        if self.thumbs_written > THUMBS_BYTE_BUDGET // 10:
+                            self.thumbs_written = 0
+                            threading.Thread(target=prune_thumbnails, daemon=True).start()
+                    except Exception as e:
+                        print(f"Error caching image {self.image_paths[index]}: {e}")
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+            year = self.extract_year_from_exif(image)
+            size_bytes = image.width * image.height * len(image.getbands())
+            entry = {'image': image, 'year': year, 'bytes': size_bytes}
+            with self.cache_lock:
+                old_entry = self.image_cache.get(index)
+                if old_entry:
+                    self.cache_bytes -= old_entry['bytes']
+                self.image_cache[index] = entry
+                self.cache_bytes += size_bytes
             self.error_count = 0
-            return image
+            return entry
         except Exception as e:
             print(f"Error loading image {self.image_paths[index]}: {e}")
             self.error_count += 1
-            if self.error_count == MAX_ERROR_COUNT:
-                print("Too many errors, exiting")
-                exit(1)
+            if self.error_count >= MAX_ERROR_COUNT:
+                # The counter is not reset, so the first failure after cooldown starts it again
+                print(f"Too many errors, retrying in {ERROR_COOLDOWN} seconds")
+                self.error_cooldown = time.monotonic() + ERROR_COOLDOWN
             return None
 
     def show_previous_image(self):
         # Go to previous image
         self.stop_timer()
 
-        prev_index = (self.current_index - 2) % len(self.image_paths)
-        
-        # If image is not in cache, load it synchronously
-        if prev_index not in self.image_cache:
-            image = self.load_image_sync(prev_index)
-            if image is None:
-                # Skip to next if loading failed
-                self.current_index = (prev_index + 1) % len(self.image_paths)
-                self.show_next_image()
-                return
-                
-        self.current_index = prev_index
+        self.current_index = (self.current_index - 2) % len(self.image_paths)
         self.show_next_image()
     
     def toggle_pause(self):
@@ -341,26 +523,15 @@ class Slideshow:
     
     def show_next_image(self):
         # Go to next image and schedule next update if not paused
-        next_index = (self.current_index + 1) % len(self.image_paths)
-        
-        # If next image is not in cache, load it synchronously
-        if next_index not in self.image_cache:
-            image = self.load_image_sync(next_index)
-            if image is None:
-                # Skip to next if loading failed
-                self.current_index = next_index
-                self.timer_id = self.root.after(100, self.show_next_image)
-                return
-        
-        self.current_index = next_index
-        self.show_current_image()
+        self.current_index = (self.current_index + 1) % len(self.image_paths)
         
         # Schedule next update only if not paused
+        # Do it before showing, so the timer is replaced when the image has to be skipped
         if not self.is_paused:
             self.timer_id = self.root.after(self.interval, self.show_next_image)
-            
-        # Preload next image in background
-        self.preload_next_image()
+        
+        # Image is shown later if it's not loaded yet, next images are preloaded there too
+        self.show_current_image()
     
     def show_settings(self):
         # Create settings dialog
@@ -424,6 +595,7 @@ class Slideshow:
         self.interval = 3000  # default 3 seconds
         self.window_size = (1024, 768)  # default window size
         self.is_fullscreen = False  # default to windowed mode
+        self.resample_name = 'bilinear'  # default resampling filter, 'lanczos' is slower but sharper
         
         # Try to load from config file
         if os.path.exists(CONFIG_FILE):
@@ -434,23 +606,30 @@ class Slideshow:
                 height = self.config.getint('Settings', 'window_height', fallback=768)
                 self.window_size = (width, height)
                 self.is_fullscreen = self.config.getboolean('Settings', 'is_fullscreen', fallback=False)
+                self.resample_name = self.config.get('Settings', 'resample', fallback='bilinear').lower()
+                if self.resample_name not in ('bilinear', 'lanczos'):
+                    print(f"Unknown resample filter '{self.resample_name}', using bilinear")
+                    self.resample_name = 'bilinear'
         else:
             # Create default config
             self.config['Settings'] = {
                 'interval': self.interval,
                 'window_width': self.window_size[0],
                 'window_height': self.window_size[1],
-                'is_fullscreen': str(self.is_fullscreen).lower()
+                'is_fullscreen': str(self.is_fullscreen).lower(),
+                'resample': self.resample_name
             }
             with open(CONFIG_FILE, 'w') as f:
                 self.config.write(f)
+        self.resample = Image.Resampling[self.resample_name.upper()]
     
     def save_settings(self):
         self.config['Settings'] = {
             'interval': str(self.interval),
             'window_width': str(self.window_size[0]),
             'window_height': str(self.window_size[1]),
-            'is_fullscreen': str(self.is_fullscreen).lower()
+            'is_fullscreen': str(self.is_fullscreen).lower(),
+            'resample': self.resample_name
         }
         with open(CONFIG_FILE, 'w') as f:
             self.config.write(f)
@@ -490,46 +669,27 @@ class Slideshow:
         self.save_settings()
         dialog.destroy()
     
-    def get_image_year(self, image_path):
-        try:
-            # Try to get year from EXIF data
-            with Image.open(image_path) as img:
-                exif = img.getexif()
-                if exif:
-                    # List of EXIF tags that might contain date information
-                    date_tags = ['DateTime', 'DateTimeOriginal', 'DateTimeDigitized', 'CreateDate']
-                    
-                    # First try standard EXIF tags
-                    for tag_id in ExifTags.TAGS:
-                        tag_name = ExifTags.TAGS[tag_id]
-                        if tag_name in date_tags and tag_id in exif:
-                            # EXIF DateTime format: "YYYY:MM:DD HH:MM:SS"
-                            return exif[tag_id][:4]
-                    
-                    # Then try extended EXIF tags
-                    try:
-                        exif_ifd = exif.get_ifd(0x8769)  # ExifIFD
-                        if exif_ifd:
-                            for tag_id in exif_ifd:
-                                if ExifTags.TAGS.get(tag_id) in date_tags:
-                                    return exif_ifd[tag_id][:4]
-                    except:
-                        pass
-            
-            # If no EXIF data, try modification time first, then creation time
-            try:
-                mtime = os.path.getmtime(image_path)
-                return str(datetime.fromtimestamp(mtime).year)
-            except:
-                ctime = os.path.getctime(image_path)
-                return str(datetime.fromtimestamp(ctime).year)
-        except:
-            return ""  # Return empty string if all methods fail
-
     def on_window_configure(self, event):
+        # The event also comes for all child widgets, only the main window matters.
+        # Skip events that don't change window geometry
+        if event.widget != self.root:
+            return
+        geometry = (event.x, event.y, event.width, event.height)
+        if geometry == self.last_configure:
+            return
+        self.last_configure = geometry
+        
+        # Handle only the final geometry when the window is being dragged or resized
+        if self.configure_job:
+            self.root.after_cancel(self.configure_job)
+        self.configure_job = self.root.after(50, self.apply_window_geometry)
+    
+    def apply_window_geometry(self):
+        self.configure_job = None
+        
         # Only save window size if we're in windowed mode and the window was actually resized
-        if not self.is_fullscreen and event.widget == self.root:
-            new_size = (event.width, event.height)
+        if not self.is_fullscreen:
+            new_size = self.last_configure[2:]
             if hasattr(self, 'window_size') and self.window_size != new_size:
                 self.window_size = new_size
                 self.save_settings()
@@ -569,35 +729,11 @@ class Slideshow:
     
     def apply_exif_orientation(self, image):
         try:
-            # Get EXIF data
-            exif = image.getexif()
-            if exif is None:
-                return image
-
-            # Get orientation tag
-            orientation = exif.get(0x0112)  # 0x0112 is the orientation tag ID
-            if orientation is None:
-                return image
-
-            # Apply orientation
-            if orientation == 2:
-                return image.transpose(Image.FLIP_LEFT_RIGHT)
-            elif orientation == 3:
-                return image.transpose(Image.ROTATE_180)
-            elif orientation == 4:
-                return image.transpose(Image.FLIP_TOP_BOTTOM)
-            elif orientation == 5:
-                return image.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_90)
-            elif orientation == 6:
-                return image.transpose(Image.ROTATE_270)
-            elif orientation == 7:
-                return image.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
-            elif orientation == 8:
-                return image.transpose(Image.ROTATE_90)
-            return image
+            # Rotate image in place, this avoids copying it when there is no orientation tag
+            ImageOps.exif_transpose(image, in_place=True)
         except Exception as e:
             print(f"Error applying EXIF orientation: {e}")
-            return image
+        return image
     
     def extract_year_from_exif(self, image):
         """Try to get year from EXIF data"""
@@ -606,63 +742,128 @@ class Slideshow:
             if not exif:
                 return None
 
-            # List of EXIF tags that might contain date information
-            date_tags = ['DateTime', 'DateTimeOriginal', 'DateTimeDigitized', 'CreateDate']
-            
-            # First try standard EXIF tags
-            for tag_id in ExifTags.TAGS:
-                tag_name = ExifTags.TAGS[tag_id]
-                if tag_name in date_tags and tag_id in exif:
-                    # EXIF DateTime format: "YYYY:MM:DD HH:MM:SS"
-                    return exif[tag_id][:4]
-            
-            # Then try extended EXIF tags
-            exif_ifd = exif.get_ifd(0x8769)  # ExifIFD
-            if exif_ifd:
-                for tag_id in exif_ifd:
-                    if ExifTags.TAGS.get(tag_id) in date_tags:
-                        return exif_ifd[tag_id][:4]
-        except:
+            # First try standard EXIF tags, then extended ones
+            for tags in (exif, exif.get_ifd(ExifTags.IFD.Exif)):
+                for tag_id in DATE_TAGS:
+                    value = tags.get(tag_id)
+                    if value:
+                        # EXIF DateTime format: "YYYY:MM:DD HH:MM:SS"
+                        return value[:4]
+        except Exception as e:
             print(f"Error getting year from EXIF: {e}")
-            return None
+        return None
 
     def preload_next_image(self):
-        """Queue the next image for background loading"""
-        next_index = (self.current_index + 1) % len(self.image_paths)
-        if next_index not in self.image_cache:
-            self.load_queue.put(next_index)
+        """Queue several next images for background loading"""
+        for i in range(1, PRELOAD_DEPTH + 1):
+            next_index = (self.current_index + i) % len(self.image_paths)
+            self.request_image(next_index, PRIORITY_PRELOAD)
+
+    def request_image(self, index, priority):
+        """Return cache entry of image, or queue it for background loading and return None if it's not cached"""
+        with self.cache_lock:
+            entry = self.image_cache.get(index)
+            if entry is not None:
+                if priority == PRIORITY_SHOW:
+                    # Mark as recently used
+                    self.image_cache.move_to_end(index)
+                return entry
+            # Queue again even if already queued, so the image jumps ahead of preloaded ones,
+            # but not when it's being loaded right now
+            if index not in self.inflight or (priority == PRIORITY_SHOW and index not in self.loading):
+                self.inflight.add(index)
+                self.load_queue.put((priority, next(self.load_counter), index))
+            return None
+
+    def trim_cache(self):
+        """Remove least recently used entries if cache is too large, but never the one being shown"""
+        # Called from loader threads, which is fine as entries contain no Tk objects.
+        # Evicted images are released after the lock is freed, so freeing large buffers
+        # doesn't hold back the UI thread waiting for the cache
+        evicted = []
+        with self.cache_lock:
+            while self.cache_bytes > CACHE_BYTE_BUDGET and len(self.image_cache) > 1:
+                oldest = next(iter(self.image_cache))
+                if oldest == self.current_index:
+                    self.image_cache.move_to_end(oldest)
+                    oldest = next(iter(self.image_cache))
+                entry = self.image_cache.pop(oldest)
+                self.cache_bytes -= entry['bytes']
+                evicted.append(entry)
+        evicted.clear()
 
     def background_loader(self):
         """Background thread for loading images"""
         while True:
-            index = self.load_queue.get()
-            if index not in self.image_cache:
+            _, _, index = self.load_queue.get()
+            with self.cache_lock:
+                # Skip stale items of images already loaded or being loaded by another thread
+                skip = index not in self.inflight or index in self.loading or index in self.image_cache
+                if skip:
+                    if index not in self.loading:
+                        self.inflight.discard(index)
+                else:
+                    self.loading.add(index)
+            if not skip:
+                entry = None
                 try:
-                    # Load and process image
-                    image = self.load_image_sync(index)
-                    if image:
-                        # Store in cache
-                        self.image_cache[index] = image
+                    # Load and process image, it's stored in cache
+                    entry = self.load_image_sync(index)
+                    if entry:
                         print(f"Preloaded {self.image_paths[index]}")
-
-                    # Remove old entries if cache is too large
-                    if len(self.image_cache) > self.cache_size:
-                        oldest = min(k for k in self.image_cache.keys() if k != self.current_index)
-                        del self.image_cache[oldest]
+                    self.trim_cache()
                 except Exception as e:
                     print(f"Error preloading image {self.image_paths[index]}: {e}")
+                with self.cache_lock:
+                    self.loading.discard(index)
+                    self.inflight.discard(index)
+                # Let the UI thread show the image if it's waiting for it.
+                # Tk refuses calls from other threads before its main loop is started
+                # and after it's finished, the thread must keep serving the queue anyway
+                try:
+                    self.root.after(0, self.on_image_ready, index, entry is not None)
+                except RuntimeError as e:
+                    print(f"Can't notify about loaded image {self.image_paths[index]}: {e}")
             self.load_queue.task_done()
 
+    def on_image_ready(self, index, loaded):
+        """Show image loaded in background if it's the one waited for"""
+        if index != self.waiting_index or index != self.current_index:
+            return
+        self.waiting_index = None
+        if loaded:
+            self.show_current_image()
+        elif time.monotonic() < self.error_cooldown:
+            # The image is not bad, loading is paused after many errors in a row,
+            # show the same image again when the pause is over
+            self.show_placeholder("Reconnecting...")
+            self.stop_timer()
+            delay = int((self.error_cooldown - time.monotonic()) * 1000) + 100
+            self.current_index = (self.current_index - 1) % len(self.image_paths)
+            self.timer_id = self.root.after(delay, self.show_next_image)
+        else:
+            self.skip_bad_image(f"Error displaying image {self.image_paths[index]}: Failed to load image")
+
+    def show_placeholder(self, text):
+        """Show text instead of image that is not loaded yet"""
+        self.label.configure(image='', text=text)
+        self.label.image = None
+        self.current_year = None
+        self.update_parent_dir_position()
+
     def show_current_image(self):
         try:
-            # Get image from cache or load it
-            if self.current_index in self.image_cache:
-                image = self.image_cache[self.current_index]
-            else:
-                # Load and process image if not in cache
-                image = self.load_image_sync(self.current_index)
-                if image is None:
-                    raise Exception("Failed to load image")
+            # Get image from cache, loading and decoding never happen in the UI thread.
+            # This is the only place where missing image is requested for display
+            entry = self.request_image(self.current_index, PRIORITY_SHOW)
+            if entry is None:
+                # Show placeholder until the image is loaded in background
+                self.waiting_index = self.current_index
+                self.show_placeholder("Loading...")
+                self.preload_next_image()
+                return
+            self.waiting_index = None
+            self.current_year = entry['year']
             print(f"Shown {self.image_paths[self.current_index]}")
 
             # Update parent directory position when showing new image
@@ -683,48 +884,73 @@ class Slideshow:
                 display_width = self.root.winfo_width()
                 display_height = self.root.winfo_height()
             
-            # Calculate aspect ratios
-            image_ratio = image.width / image.height
-            display_ratio = display_width / display_height
-            
-            if display_ratio > image_ratio:
-                # Display is wider than image
-                height = display_height
-                width = int(height * image_ratio)
-            else:
-                # Display is taller than image
-                width = display_width
-                height = int(width / image_ratio)
-            
-            # Resize image
-            image = image.resize((width, height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage
-            photo = ImageTk.PhotoImage(image)
+            # Render image for the display size unless it's already done,
+            # e.g. when the same image is shown again after pause
+            display_size = (display_width, display_height)
+            source = self.photo_source
+            if source is None or source[0] is not entry['image'] or source[1] != display_size:
+                image = entry['image']
+                
+                # Image is fitted to screen on loading, so in fullscreen mode
+                # it already fits the display and doesn't need another copy
+                already_fits = image.width <= display_width and image.height <= display_height and \
+                    (image.width == display_width or image.height == display_height)
+                if not already_fits:
+                    # Calculate aspect ratios
+                    image_ratio = image.width / image.height
+                    display_ratio = display_width / display_height
+                    
+                    if display_ratio > image_ratio:
+                        # Display is wider than image
+                        height = display_height
+                        width = int(height * image_ratio)
+                    else:
+                        # Display is taller than image
+                        width = display_width
+                        height = int(width / image_ratio)
+                    
+                    # Resize image
+                    # The image is already reduced to screen size, so bilinear filter is good enough
+                    # unless high quality lanczos is chosen in settings
+                    image = image.resize((width, height), self.resample)
+                
+                # Convert to PhotoImage, the previous one is released here in the UI thread
+                self.photo = ImageTk.PhotoImage(image)
+                self.photo_source = (entry['image'], display_size)
+            photo = self.photo
             
             # Update label
             self.label.configure(image=photo)
             self.label.image = photo  # Keep a reference
             
         except Exception as e:
-            error_msg = f"Error displaying image {self.image_paths[self.current_index]}: {e}"
-            print(error_msg)
-            
-            # Create bad images file on first error if it doesn't exist
-            if not self.bad_images_file:
-                timestamp = self.start_timestamp.strftime("%Y%m%d_%H%M%S")
-                self.bad_images_file = f"bad_images_{timestamp}.{DEF_EXT}"
-                with open(self.bad_images_file, 'w') as f:
-                    f.write("# Corrupted images log\n")
-                    f.write(f"# Created: {self.start_timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            
-            # Log error to bad images file
-            with open(self.bad_images_file, 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {error_msg}\n")
-            
-            # Skip to next image
-            self.current_index = (self.current_index + 1) % len(self.image_paths)
-            self.timer_id = self.root.after(100, self.show_next_image)
+            self.skip_bad_image(f"Error displaying image {self.image_paths[self.current_index]}: {e}")
+
+    def skip_bad_image(self, error_msg):
+        """Log error of image that can't be shown and go to the next one"""
+        print(error_msg)
+        
+        # Create bad images file on first error and keep it open,
+        # it's line buffered so each error is written out immediately
+        if not self.bad_images_log:
+            timestamp = self.start_timestamp.strftime("%Y%m%d_%H%M%S")
+            self.bad_images_file = f"bad_images_{timestamp}.{DEF_EXT}"
+            self.bad_images_log = open(self.bad_images_file, 'w', buffering=1)
+            self.bad_images_log.write("# Corrupted images log\n")
+            self.bad_images_log.write(f"# Created: {self.start_timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        
+        # Log error to bad images file
+        self.bad_images_log.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {error_msg}\n")
+        
+        # Skip to next image
+        self.stop_timer()
+        self.timer_id = self.root.after(100, self.show_next_image)
+
+    def close(self):
+        """Close files left open by the slideshow"""
+        if self.bad_images_log:
+            self.bad_images_log.close()
+            self.bad_images_log = None
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Photo slideshow application')
@@ -737,3 +963,4 @@ if __name__ == "__main__":
     photos_file = ensure_ext(args.photos_file)
     app = Slideshow(root, photos_file=photos_file, server_url=args.server)
     root.mainloop()
+    app.close()
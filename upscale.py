@@ -1,10 +1,188 @@
 import os
 from pathlib import Path
+import threading
+from queue import Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+from PIL import Image
 from realesrgan_ncnn_py import Realesrgan
 
-def upscale_image(input_path, output_path=None, scale=4, model_name='realesrnet-x4plus', gpu_id=0):
+# Number of images read ahead and upscaled together in batch mode
+UPSCALE_BATCH_SIZE = 8
+# Maximum number of images read ahead of the upscaler in batch mode
+UPSCALE_READ_AHEAD = 16
+
+# JPEG images can be decoded at reduced resolution right in the decoder (DCT scaling)
+JPEG_REDUCED_READS = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                      (4, cv2.IMREAD_REDUCED_COLOR_4),
+                      (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+# Indexes of models bundled with realesrgan_ncnn_py by model name and upscaling factor
+UPSCALE_MODELS = {
+    ('realesr-animevideov3', 2): 0,
+    ('realesr-animevideov3', 3): 1,
+    ('realesr-animevideov3', 4): 2,
+    ('realesrgan-x4plus-anime', 4): 3,
+    ('realesrgan-x4plus', 4): 4,
+}
+
+# Upscaler instances by GPU id and model, loading the model is expensive so it's done once.
+# Precision is fixed inside the compiled realesrgan_ncnn_py extension (fp16 packed storage,
+# fp32 arithmetic to avoid artifacts), its ncnn net isn't exposed to Python so it can't
+# be switched to fp16 arithmetic here, and there is no INT8 option or quantized models either
+upscalers = {}
+
+# Output directories already created by this process
+ensured_dirs = set()
+
+def ensure_dir(path):
+    """
+    Create directory if it wasn't created before by this process.
+    
+    Args:
+        path (str): Directory path
+    """
+    path = os.path.abspath(path)
+    if path not in ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        ensured_dirs.add(path)
+
+def get_model_index(model_name, scale):
+    """
+    Get index of bundled model by its name and upscaling factor.
+    
+    Args:
+        model_name (str): Model name, see UPSCALE_MODELS
+        scale (int): Upscaling factor
+    
+    Returns:
+        int: Model index for get_upscaler
+    """
+    model = UPSCALE_MODELS.get((model_name, scale))
+    if model is None:
+        scales = [s for name, s in UPSCALE_MODELS if name == model_name]
+        if not scales:
+            raise ValueError(f"Unknown model: {model_name}")
+        raise ValueError(f"Model {model_name} supports only {', '.join(f'{s}x' for s in scales)} upscaling")
+    return model
+
+def get_upscaler(gpu_id=0, model=0, tile_size=0):
+    """
+    Get Real-ESRGAN instance for the GPU and model, creating it on first use.
+    
+    Args:
+        gpu_id (int): GPU to run the upscaler on
+        model (int): Index of model bundled with realesrgan_ncnn_py, see get_model_index
+            (default: 0, realesr-animevideov3 2x)
+        tile_size (int): Size of tiles the image is split into, at least 32,
+            smaller tiles need less GPU memory (default: 0, chosen automatically)
+    
+    Returns:
+        Realesrgan: Upscaler instance
+    """
+    key = (gpu_id, model, tile_size)
+    upscaler = upscalers.get(key)
+    if upscaler is None:
+        # Tiles are processed with padding and stitched inside the upscaler
+        upscaler = Realesrgan(gpuid=gpu_id, model=model, tilesize=tile_size)
+        upscalers[key] = upscaler
+    return upscaler
+
+def upscale_ndarray(img, gpu_id=0, tile_size=0, model=0):
+    """
+    Upscale an image already loaded into memory.
+    
+    Args:
+        img (numpy.ndarray): OpenCV image array
+        gpu_id (int): GPU to run the upscaler on
+        tile_size (int): Tile size, see get_upscaler
+        model (int): Model index, see get_upscaler
+    
+    Returns:
+        numpy.ndarray: Upscaled image array
+    """
+    return get_upscaler(gpu_id, model, tile_size).process_cv2(img)
+
+def upscale_images_batch(images, gpu_id=0, tile_size=0, model=0):
+    """
+    Upscale several images with the same upscaler instance.
+    
+    Args:
+        images (list): OpenCV image arrays
+        gpu_id (int): GPU to run the upscaler on
+        tile_size (int): Tile size, see get_upscaler
+        model (int): Model index, see get_upscaler
+    
+    Returns:
+        list: Upscaled image arrays in the same order as input ones,
+            exception raised by the upscaler is placed instead of image that failed
+    """
+    upscaler = get_upscaler(gpu_id, model, tile_size)
+    
+    # Process images of the same size one after another,
+    # so the network can reuse buffers allocated for the previous image
+    order = sorted(range(len(images)), key=lambda i: images[i].shape)
+    results = [None] * len(images)
+    for i in order:
+        # One bad image shouldn't discard the whole batch
+        try:
+            results[i] = upscaler.process_cv2(images[i])
+        except Exception as e:
+            results[i] = e
+    return results
+
+def read_image(path, max_size=None):
+    """
+    Read image, decoding large JPEG images at reduced resolution.
+    
+    Args:
+        path (str): Path to the image
+        max_size (int, optional): If the longer side of JPEG image is at least 2, 4 or 8 times
+            larger than this, the image is decoded 2, 4 or 8 times smaller (the largest
+            reduction keeping the longer side not less than max_size is chosen)
+    
+    Returns:
+        numpy.ndarray: OpenCV image array or None if the image can't be read
+    """
+    flags = cv2.IMREAD_COLOR
+    if max_size and path.lower().endswith(('.jpg', '.jpeg')):
+        # Only the header is read to get the image size
+        try:
+            with Image.open(path) as img:
+                long_side = max(img.size)
+        except OSError:
+            long_side = 0
+        for factor, reduced_flags in JPEG_REDUCED_READS:
+            if long_side // factor >= max_size:
+                flags = reduced_flags
+                break
+    return cv2.imread(path, flags)
+
+def iter_images(directory, extensions):
+    """
+    Recursively yield paths of image files in the directory.
+    
+    Args:
+        directory (str): Directory to scan
+        extensions (set): Lowercase image file extensions with dot, e.g. '.jpg'
+    
+    Yields:
+        str: Path to the image file
+    """
+    # Entry types come from the directory listing itself, without stat() call per file
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_images(entry.path, extensions)
+            elif entry.is_file():
+                name = entry.name
+                dot = name.rfind('.')
+                if dot > 0 and name[dot:].lower() in extensions:
+                    yield entry.path
+
+def upscale_image(input_path, output_path=None, scale=4, model_name='realesrgan-x4plus', gpu_id=0, tile_size=0, max_size=None):
     """
     Upscale an image using Real-ESRGAN.
     
@@ -14,9 +192,12 @@ def upscale_image(input_path, output_path=None, scale=4, model_name='realesrnet-
             will append '_upscaled' to the input filename
         scale (int, optional): Upscaling factor (2, 3, or 4). Default is 4
         model_name (str, optional): Model to use. Options:
-            - 'realesrgan-x4plus' (default, good for general images)
-            - 'realesrnet-x4plus' (sharper but may have more artifacts)
-            - 'realesrgan-x4plus-anime' (optimized for anime/art)
+            - 'realesrgan-x4plus' (default, good for general images, 4x only)
+            - 'realesrgan-x4plus-anime' (optimized for anime/art, 4x only)
+            - 'realesr-animevideov3' (fast, for video frames, 2x, 3x or 4x)
+        gpu_id (int, optional): GPU to run the upscaler on. Default is 0
+        tile_size (int, optional): Tile size for large images, see get_upscaler. Default is 0
+        max_size (int, optional): Decode large JPEG images at reduced resolution, see read_image
     
     Returns:
         str: Path to the upscaled image
@@ -24,26 +205,24 @@ def upscale_image(input_path, output_path=None, scale=4, model_name='realesrnet-
     # Validate input path
     if not os.path.exists(input_path):
         raise ValueError(f"Input file not found: {input_path}")
+    model = get_model_index(model_name, scale)
     
     # Generate output path if not provided
     if output_path is None:
         input_path = Path(input_path)
         output_path = input_path.parent / f"{input_path.stem}_upscaled{input_path.suffix}"
     
-    # Create upscaler instance
-    upscaler = Realesrgan(gpuid=gpu_id)
-    
     # Ensure output directory exists
-    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    ensure_dir(os.path.dirname(os.path.abspath(output_path)))
     
     try:
         # Read image
-        img = cv2.imread(str(input_path))
+        img = read_image(str(input_path), max_size)
         if img is None:
             raise ValueError(f"Could not read image: {input_path}")
         
         # Process image using cv2 method
-        result_img = upscaler.process_cv2(img)
+        result_img = upscale_ndarray(img, gpu_id, tile_size, model)
         
         # Save result
         cv2.imwrite(str(output_path), result_img)
@@ -53,7 +232,7 @@ def upscale_image(input_path, output_path=None, scale=4, model_name='realesrnet-
         print(f"Error upscaling image {input_path}: {e}")
         raise
 
-def batch_upscale(input_dir, output_dir=None, scale=4, model_name='realesrgan-x4plus'):
+def batch_upscale(input_dir, output_dir=None, scale=4, model_name='realesrgan-x4plus', tile_size=0, max_size=None):
     """
     Upscale all images in a directory.
     
@@ -62,6 +241,8 @@ def batch_upscale(input_dir, output_dir=None, scale=4, model_name='realesrgan-x4
         output_dir (str, optional): Directory to save upscaled images
         scale (int, optional): Upscaling factor (2, 3, or 4). Default is 4
         model_name (str, optional): Model to use (see upscale_image for options)
+        tile_size (int, optional): Tile size for large images, see get_upscaler. Default is 0
+        max_size (int, optional): Decode large JPEG images at reduced resolution, see read_image
     
     Returns:
         list: Paths to all upscaled images
@@ -69,6 +250,7 @@ def batch_upscale(input_dir, output_dir=None, scale=4, model_name='realesrgan-x4
     input_dir = Path(input_dir)
     if not input_dir.exists():
         raise ValueError(f"Input directory not found: {input_dir}")
+    model = get_model_index(model_name, scale)
     
     # Set output directory
     if output_dir is None:
@@ -76,26 +258,87 @@ def batch_upscale(input_dir, output_dir=None, scale=4, model_name='realesrgan-x4
     output_dir = Path(output_dir)
     
     # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_dir(output_dir)
     
-    # Process all images
-    upscaled_images = []
+    # Find all images first, so they can be read ahead in batches
     image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}
+    files = list(iter_images(input_dir, image_extensions))
+    
+    # Create output subdirectories once for all images in them
+    for path in {os.path.dirname(os.path.relpath(file, input_dir)) for file in files}:
+        ensure_dir(output_dir / path)
+    
+    # Images are read ahead in reader threads and written in writer threads,
+    # so the upscaler doesn't wait for disk. The queue limits how many images are read ahead
+    read_queue = Queue(maxsize=UPSCALE_READ_AHEAD)
+    readers = ThreadPoolExecutor(max_workers=4)
+    writers = ThreadPoolExecutor(max_workers=2)
+    
+    def queue_reads():
+        for file in files:
+            read_queue.put((file, readers.submit(read_image, file, max_size)))
+        read_queue.put(None)
+    
+    def write_image(file, img):
+        output_path = output_dir / os.path.relpath(file, input_dir)
+        if not cv2.imwrite(str(output_path), img):
+            raise ValueError(f"Could not write image: {output_path}")
+        return str(output_path)
+    
+    def report_writes(wait=False):
+        # Results of writer threads are printed here in the main thread, in order of images,
+        # so messages of different threads don't interleave
+        while writes and (wait or writes[0][1].done()):
+            file, future = writes.popleft()
+            try:
+                upscaled_images.append(future.result())
+                print(f"Successfully upscaled image: {upscaled_images[-1]}")
+            except Exception as e:
+                print(f"Error processing {file}: {e}")
+    
+    def upscale_batch(batch):
+        try:
+            results = upscale_images_batch([img for _, img in batch], tile_size=tile_size, model=model)
+        except Exception as e:
+            # Upscaler itself can't be created, all images of the batch fail
+            results = [e] * len(batch)
+        for (file, _), result_img in zip(batch, results):
+            if isinstance(result_img, Exception):
+                print(f"Error processing {file}: {result_img}")
+                continue
+            writes.append((file, writers.submit(write_image, file, result_img)))
+        report_writes()
     
-    for file in input_dir.rglob('*'):
-        if file.suffix.lower() in image_extensions:
+    writes = deque()
+    upscaled_images = []
+    threading.Thread(target=queue_reads, daemon=True).start()
+    try:
+        batch = []
+        while True:
+            item = read_queue.get()
+            if item is None:
+                break
+            file, future = item
+            # Errors of one file must not stop the loop, the feeder thread would block on full queue
             try:
-                output_path = output_dir / file.relative_to(input_dir)
-                upscaled_path = upscale_image(
-                    str(file),
-                    str(output_path),
-                    scale=scale,
-                    model_name=model_name
-                )
-                upscaled_images.append(upscaled_path)
+                img = future.result()
             except Exception as e:
                 print(f"Error processing {file}: {e}")
+                continue
+            if img is None:
+                print(f"Error processing {file}: Could not read image")
+                continue
+            batch.append((file, img))
+            if len(batch) == UPSCALE_BATCH_SIZE:
+                upscale_batch(batch)
+                batch = []
+        if batch:
+            upscale_batch(batch)
+    finally:
+        readers.shutdown(wait=False, cancel_futures=True)
+        writers.shutdown(wait=True)
     
+    report_writes(wait=True)
     return upscaled_images
 
 if __name__ == "__main__":
@@ -105,18 +348,22 @@ if __name__ == "__main__":
     parser.add_argument('input', help='Input image or directory')
     parser.add_argument('-o', '--output', help='Output path (optional)')
     parser.add_argument('-s', '--scale', type=int, choices=[2, 3, 4], default=4,
-                       help='Upscaling factor (default: 4)')
+                       help='Upscaling factor, other than 4 only for realesr-animevideov3 model (default: 4)')
     parser.add_argument('-m', '--model', default='realesrgan-x4plus',
-                       choices=['realesrgan-x4plus', 'realesrnet-x4plus', 'realesrgan-x4plus-anime'],
+                       choices=['realesrgan-x4plus', 'realesrgan-x4plus-anime', 'realesr-animevideov3'],
                        help='Model to use (default: realesrgan-x4plus)')
+    parser.add_argument('-t', '--tile', type=int, default=0,
+                       help='Tile size, at least 32, use smaller tiles if GPU runs out of memory (default: 0, automatic)')
+    parser.add_argument('--max-size', type=int,
+                       help='Decode JPEG images at 1/2, 1/4 or 1/8 resolution if the longer side stays at least this size')
     
     args = parser.parse_args()
     
     try:
         input_path = Path(args.input)
         if input_path.is_file():
-            upscale_image(args.input, args.output, args.scale, args.model)
+            upscale_image(args.input, args.output, args.scale, args.model, tile_size=args.tile, max_size=args.max_size)
         else:
-            batch_upscale(args.input, args.output, args.scale, args.model)
+            batch_upscale(args.input, args.output, args.scale, args.model, tile_size=args.tile, max_size=args.max_size)
     except Exception as e:
         print(f"Error: {e}")
@@ -1,5 +1,3 @@
-from pathlib import Path
-
 DEF_EXT = "lst"
 
 def ensure_ext(file_name: str) -> str:
@@ -8,7 +6,11 @@ def ensure_ext(file_name: str) -> str:
     fn = file_name.strip()
     if not fn:
         return None
-    if Path(fn).suffix:
+    # The same check as Path(fn).suffix without constructing Path object:
+    # there is a dot inside the file name that is neither its first nor last character
+    name = fn[max(fn.rfind('/'), fn.rfind('\\')) + 1:]
+    dot = name.rfind('.')
+    if 0 < dot < len(name) - 1:
         return fn
     if fn.endswith('.'):
         return fn + DEF_EXT
@@ -3,22 +3,205 @@ import os
 import sys
 import argparse
 from pathlib import Path
-from upscale import upscale_image
+from upscale import upscale_ndarray
 
-def is_below_fullhd(image):
+# libjpeg-turbo bindings are optional, they encode frames faster with SIMD code
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbo_jpeg = None
+
+# PyAV is optional, it decodes videos with frame-level multithreading of libav
+try:
+    import av
+except ImportError:
+    av = None
+
+# Quality of saved frames, OpenCV uses 95 by default which gives much larger files
+JPEG_QUALITY = 90
+
+# Baseline encoding, optimized Huffman tables and progressive mode need extra passes
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+               cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+               cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+
+# Let FFmpeg decode several frames in parallel, frame threading adds latency
+# but it doesn't matter for extraction. Options given by user are respected
+os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'threads;auto|thread_type;frame')
+
+# Codecs where every frame is a keyframe, seeking to a frame doesn't decode preceding ones
+# (Motion JPEG variants, ProRes, DV, lossless FFV1 and HuffYUV)
+INTRA_ONLY_CODECS = {'MJPG', 'JPEG', 'AVRN', 'DMB1', 'MJP2',
+                     'APCN', 'APCH', 'APCS', 'APCO', 'AP4H',
+                     'DVSD', 'FFV1', 'HFYU'}
+
+def get_codec(video):
+    """
+    Get FOURCC code of the video codec.
+    
+    Args:
+        video: Opened cv2.VideoCapture
+        
+    Returns:
+        str: FOURCC code in upper case, e.g. 'H264' or 'MJPG'
+    """
+    fourcc = int(video.get(cv2.CAP_PROP_FOURCC))
+    return fourcc.to_bytes(4, 'little').decode('latin-1').upper()
+
+def has_keyframe_within(video_path, frame_count):
+    """
+    Check if there is a keyframe among the first frame_count frames after the first one.
+    
+    Args:
+        video_path (str): Path to the video file
+        frame_count (int): Number of frames to look through
+        
+    Returns:
+        bool: True if a keyframe is found, None if it can't be checked
+    """
+    # Raw mode returns encoded packets, so only demuxing is done and nothing is decoded
+    probe = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    try:
+        if not probe.isOpened() or not probe.set(cv2.CAP_PROP_FORMAT, -1) or not probe.grab():
+            return None
+        for _ in range(frame_count):
+            if not probe.grab():
+                return False
+            if probe.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                return True
+        return False
+    finally:
+        probe.release()
+
+def read_sampled_frames(video, frame_interval, seek=True):
+    """
+    Read every frame_interval-th frame of the video.
+    
+    Args:
+        video: Opened cv2.VideoCapture
+        frame_interval (int): Number of frames between samples
+        seek (bool): Jump directly to sampled frames instead of reading through all of them,
+            the decoder restarts from the previous keyframe for each sample, so it's slower
+            only if keyframes are farther apart than frame_interval
+        
+    Yields:
+        tuple: (frame number, OpenCV image array)
+    """
+    if seek:
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        for current_frame in range(0, frame_count, frame_interval):
+            video.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
+            ret, frame = video.read()
+            if not ret:
+                break
+            yield current_frame, frame
+        return
+    
+    # Go through frames sequentially, all of them are decoded but only sampled ones are retrieved
+    current_frame = 0
+    while video.grab():
+        if current_frame % frame_interval == 0:
+            # Decode and convert the sampled frame
+            ret, frame = video.retrieve()
+            if not ret:
+                break
+            yield current_frame, frame
+        current_frame += 1
+
+def is_below_fullhd(width, height):
     """
-    Check if image resolution is below FullHD (1920x1080).
+    Check if resolution is below FullHD (1920x1080).
     
     Args:
-        image: OpenCV image array
+        width (int): Image width
+        height (int): Image height
         
     Returns:
-        bool: True if image is below FullHD resolution
+        bool: True if resolution is below FullHD
     """
-    height, width = image.shape[:2]
     return width < 1920 or height < 1080
 
-def extract_frames(video_path, interval=10, output_dir=None, upscale=False):
+def save_frame(output_file, frame, dir_fd=None):
+    """
+    Save frame as JPG file.
+    
+    Args:
+        output_file (str): Path to the output file
+        frame: OpenCV image array
+        dir_fd (int): Descriptor of the opened output directory,
+            if given the file is created relative to it without resolving the whole path
+    """
+    # Encode in memory and write the buffer directly
+    if turbo_jpeg:
+        data = turbo_jpeg.encode(frame, quality=JPEG_QUALITY)
+    else:
+        ok, data = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+        if not ok:
+            raise ValueError(f"Could not encode frame: {output_file}")
+    
+    if dir_fd is not None:
+        fd = os.open(os.path.basename(output_file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666, dir_fd=dir_fd)
+        with open(fd, 'wb') as f:
+            f.write(data)
+    else:
+        with open(output_file, 'wb') as f:
+            f.write(data)
+
+def read_sampled_frames_cuda(video_path, frame_interval):
+    """
+    Read every frame_interval-th frame of the video decoding it on NVIDIA GPU.
+    
+    Args:
+        video_path (str): Path to the video file
+        frame_interval (int): Number of frames between samples
+        
+    Yields:
+        tuple: (frame number, OpenCV image array)
+    """
+    reader = cv2.cudacodec.createVideoReader(video_path)
+    reader.set(cv2.cudacodec.ColorFormat_BGR)
+    
+    # Skipped frames stay in GPU memory, only sampled ones are downloaded
+    current_frame = 0
+    while reader.grab():
+        if current_frame % frame_interval == 0:
+            ret, gpu_frame = reader.retrieve()
+            if not ret:
+                break
+            yield current_frame, gpu_frame.download()
+        current_frame += 1
+
+def read_sampled_frames_av(video_path, frame_interval):
+    """
+    Read every frame_interval-th frame of the video decoding it with PyAV.
+    
+    Args:
+        video_path (str): Path to the video file
+        frame_interval (int): Number of frames between samples
+        
+    Yields:
+        tuple: (frame number, OpenCV image array)
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        # Decode several frames in parallel (frame threading) or slices of a frame
+        stream.thread_type = 'AUTO'
+        
+        # All frames have to be decoded as references for the following ones,
+        # but only sampled frames are converted to BGR arrays
+        for current_frame, frame in enumerate(container.decode(stream)):
+            if current_frame % frame_interval == 0:
+                yield current_frame, frame.to_ndarray(format='bgr24')
+
+def is_cuda_decoder_available():
+    """Check if OpenCV is built with NVIDIA video decoder and there is a CUDA device."""
+    try:
+        return hasattr(cv2, 'cudacodec') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except cv2.error:
+        return False
+
+def extract_frames(video_path, interval=10, output_dir=None, upscale=False, decoder='cpu'):
     """
     Extract frames from a video file at specified intervals.
     
@@ -26,19 +209,48 @@ def extract_frames(video_path, interval=10, output_dir=None, upscale=False):
         video_path (str): Path to the video file
         interval (int): Interval in seconds between frames (default: 10)
         output_dir (str): Directory to save frames (default: based on video filename)
+        upscale (bool): Upscale frames that are below FullHD resolution
+        decoder (str): 'cpu', 'cuda' to decode on NVIDIA GPU or 'av' to decode with PyAV (default: 'cpu')
     """
     # Open the video file
-    video = cv2.VideoCapture(video_path)
+    # FFmpeg backend is requested explicitly, it's the one that can seek within containers
+    video = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not video.isOpened():
+        video = cv2.VideoCapture(video_path)
     if not video.isOpened():
         raise ValueError(f"Could not open video file: {video_path}")
     
     # Get video properties
     fps = video.get(cv2.CAP_PROP_FPS)
     frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    if fps <= 0:
+        video.release()
+        raise ValueError(f"Could not get frame rate of video file: {video_path}")
     duration = frame_count / fps
     
     # Calculate frame interval
-    frame_interval = int(fps * interval)
+    frame_interval = max(1, int(fps * interval))
+    
+    # Resolution is the same for all frames, so check once if they need upscaling,
+    # if the container doesn't report frame size it's checked on the first frame
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    needs_upscale = (upscale and is_below_fullhd(width, height)) if width and height else None
+    
+    if decoder == 'cuda' and not is_cuda_decoder_available():
+        print("Warning: CUDA video decoder is not available, decoding on CPU")
+        decoder = 'cpu'
+    if decoder == 'av' and av is None:
+        print("Warning: PyAV is not installed, decoding with OpenCV")
+        decoder = 'cpu'
+    
+    # Jump between sampled frames unless keyframes are so rare that seeking
+    # would decode more frames than reading through all of them
+    # (only OpenCV decoding on CPU seeks, other decoders read through the whole stream)
+    codec = get_codec(video)
+    seek = decoder == 'cpu' and frame_count > 0
+    if seek and codec not in INTRA_ONLY_CODECS:
+        seek = has_keyframe_within(video_path, frame_interval) is not False
     
     # Create output directory
     if output_dir is None:
@@ -47,55 +259,55 @@ def extract_frames(video_path, interval=10, output_dir=None, upscale=False):
     
     os.makedirs(output_dir, exist_ok=True)
     
+    # Keep output directory opened to create frame files relative to it (not supported on Windows)
+    dir_fd = os.open(output_dir, os.O_RDONLY) if os.open in os.supports_dir_fd else None
+    
     # Process video
-    current_frame = 0
     frames_saved = 0
     
-    print(f"Video duration: {duration:.2f} seconds")
-    print(f"Extracting frames every {interval} seconds...")
+    print(f"Video duration: {duration:.2f} seconds, codec: {codec.strip()}")
+    print(f"Extracting frames every {interval} seconds{' with seeking' if seek else ''}...")
     
-    while True:
-        # Set frame position
-        video.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-        
-        # Read frame
-        ret, frame = video.read()
-        if not ret:
-            break
-        
-        # Calculate timestamp
-        timestamp = current_frame / fps
-        
-        # Generate output filename
-        output_file = os.path.join(output_dir, f"{Path(video_path).stem}_{int(timestamp)}s.jpg")
-        
-        # Check if upscaling is needed
-        if upscale and is_below_fullhd(frame):
-            # Save original frame temporarily
-            temp_file = output_file.replace('.jpg', '_temp.jpg')
-            cv2.imwrite(temp_file, frame)
+    if decoder == 'cuda':
+        # Video properties are already known, hand decoding over to GPU
+        video.release()
+        frames = read_sampled_frames_cuda(video_path, frame_interval)
+    elif decoder == 'av':
+        video.release()
+        frames = read_sampled_frames_av(video_path, frame_interval)
+    else:
+        frames = read_sampled_frames(video, frame_interval, seek)
+    
+    try:
+        for current_frame, frame in frames:
+            # Calculate timestamp
+            timestamp = current_frame / fps
             
-            # Upscale the frame
-            try:
-                upscale_image(temp_file, output_file)
-                os.remove(temp_file)  # Clean up temp file
-                print(f"Saved and upscaled frame at {int(timestamp)}s -> {output_file}")
-            except Exception as e:
-                print(f"Warning: Failed to upscale frame at {int(timestamp)}s: {e}")
-                # If upscaling fails, save original frame
-                os.rename(temp_file, output_file)
-                print(f"Saved original frame at {int(timestamp)}s -> {output_file}")
-        else:
-            # Save frame without upscaling
-            cv2.imwrite(output_file, frame)
-            print(f"Saved frame at {int(timestamp)}s -> {output_file}")
-        
-        frames_saved += 1
-        
-        # Move to next interval
-        current_frame += frame_interval
-        if current_frame >= frame_count:
-            break
+            # Generate output filename
+            output_file = os.path.join(output_dir, f"{Path(video_path).stem}_{int(timestamp)}s.jpg")
+            
+            # Check if upscaling is needed
+            if needs_upscale is None:
+                needs_upscale = upscale and is_below_fullhd(frame.shape[1], frame.shape[0])
+            if needs_upscale:
+                # Upscale the frame in memory, without lossy saving and reading it again
+                try:
+                    save_frame(output_file, upscale_ndarray(frame), dir_fd)
+                    print(f"Saved and upscaled frame at {int(timestamp)}s -> {output_file}")
+                except Exception as e:
+                    print(f"Warning: Failed to upscale frame at {int(timestamp)}s: {e}")
+                    # If upscaling fails, save original frame
+                    save_frame(output_file, frame, dir_fd)
+                    print(f"Saved original frame at {int(timestamp)}s -> {output_file}")
+            else:
+                # Save frame without upscaling
+                save_frame(output_file, frame, dir_fd)
+                print(f"Saved frame at {int(timestamp)}s -> {output_file}")
+            
+            frames_saved += 1
+    finally:
+        if dir_fd is not None:
+            os.close(dir_fd)
     
     video.release()
     print(f"\nCompleted! Saved {frames_saved} frames to {output_dir}/")
@@ -109,6 +321,9 @@ def main():
     parser.add_argument('-o', '--output-dir', help='Output directory (default: based on video filename)')
     parser.add_argument('-u', '--upscale', action='store_true',
                        help='Upscale frames that are below FullHD (1920x1080) resolution')
+    parser.add_argument('-d', '--decoder', choices=['cpu', 'cuda', 'av'], default='cpu',
+                       help='Decode video on CPU, on NVIDIA GPU (requires OpenCV built with CUDA) ' +
+                       'or with PyAV using multiple threads (default: cpu)')
     
     args = parser.parse_args()
     
@@ -119,7 +334,7 @@ def main():
             sys.exit(1)
         
         # Extract frames
-        extract_frames(args.video_path, args.interval, args.output_dir, args.upscale)
+        extract_frames(args.video_path, args.interval, args.output_dir, args.upscale, args.decoder)
         
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)